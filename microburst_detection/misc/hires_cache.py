@@ -0,0 +1,197 @@
+# A binary cache of parsed HiRes days.
+import functools
+import hashlib
+import json
+import os
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+from microburst_detection.misc.load_firebird import HiRes, _cast_column, readJSONheadedASCII
+
+
+class HiResCache:
+    def __init__(self, cache_dir, max_size_gb=10, validate_hash=False):
+        """
+        Cache the parsed HiRes days as uncompressed numpy .npz files so
+        that reruns don't need to parse the text files. Pass an instance
+        of this class to readJSONheadedASCII via the cache kwarg.
+
+        A cache entry is invalidated when the source file's size or
+        modification time changes (and optionally its SHA-1 hash). When the
+        cache grows above max_size_gb, the least recently used entries are
+        deleted.
+
+        Parameters
+        ----------
+        cache_dir : str or pathlib.Path
+            The cache directory. It is created if it does not exist.
+        max_size_gb : float
+            The maximum total size of the cache entries in GB.
+        validate_hash : bool
+            If True, also compare the SHA-1 hash of the source file. This
+            is slower, but catches files that were modified in place with
+            their modification time preserved.
+        """
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.max_size_gb = max_size_gb
+        self.validate_hash = validate_hash
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        return
+
+    def load(self, file_path, columns=None, dtypes=None):
+        """
+        Load the HiRes data for file_path from the cache. Returns None if
+        the file is not cached, or the cached entry is stale.
+
+        If columns is not None, only Time and the columns are loaded and
+        the other columns are loaded when they are first accessed. The
+        columns are converted to the dtypes schema (see
+        readJSONheadedASCII).
+        """
+        entry_path = self._entry_path(file_path)
+        try:
+            entry_file = np.load(entry_path, allow_pickle=False)
+        except FileNotFoundError:
+            # Not cached, or another process just evicted it.
+            return None
+
+        with entry_file as entry:
+            source = json.loads(str(entry['_source']))
+            if source != self._source_identity(file_path, source_hash=source.get('sha1')):
+                return None
+            column_keys = [key for key in entry.files if not key.startswith('_')]
+            if columns is None:
+                columns = column_keys
+            data = HiRes(self._load_columns(
+                entry_path, ['Time'] + list(columns), dtypes=dtypes, entry=entry
+                ))
+            data.attrs = json.loads(str(entry['_attrs']))
+        data._lazy_columns = set(column_keys) - set(data.keys())
+        data._column_loader = functools.partial(
+            self._load_lazy_columns, entry_path, file_path, dtypes=dtypes
+            )
+        # Mark this entry as recently used for the eviction policy.
+        try:
+            os.utime(entry_path)
+        except FileNotFoundError:
+            pass  # Evicted by another process, the lazy columns fall back.
+        return data
+
+    def _load_lazy_columns(self, entry_path, file_path, keys, dtypes=None):
+        """
+        Load the lazy keys columns from a cache entry. If another process
+        evicted the entry after it was loaded, the columns are parsed from
+        the source file instead.
+        """
+        try:
+            return self._load_columns(entry_path, keys, dtypes=dtypes)
+        except FileNotFoundError:
+            data = readJSONheadedASCII(file_path, columns=keys, dtypes=dtypes)
+            return {key:data[key] for key in keys}
+
+    def _load_columns(self, entry_path, keys, dtypes=None, entry=None):
+        """
+        Load the keys columns from a cache entry and convert them to the
+        dtypes schema.
+        """
+        if entry is None:
+            with np.load(entry_path, allow_pickle=False) as entry:
+                return self._load_columns(entry_path, keys, dtypes=dtypes, entry=entry)
+
+        data = {}
+        for key in dict.fromkeys(keys):
+            if key == 'Time':
+                data[key] = pd.DatetimeIndex(entry[key])
+            else:
+                data[key] = _cast_column(key, entry[key], dtypes)
+        return data
+
+    def save(self, file_path, data):
+        """
+        Save the parsed HiRes data from file_path to the cache.
+        """
+        entry_path = self._entry_path(file_path)
+        source = self._source_identity(file_path)
+        arrays = {key:np.asarray(val) for key, val in data.items()}
+        arrays['_source'] = np.array(json.dumps(source))
+        arrays['_attrs'] = np.array(json.dumps(data.attrs))
+
+        # Write to a temporary file first so a partially written entry is
+        # never read.
+        tmp_path = entry_path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, entry_path)
+        self._evict()
+        return
+
+    def clear(self):
+        """
+        Delete all cache entries.
+        """
+        for entry_path in self.cache_dir.glob('*.npz'):
+            entry_path.unlink()
+        return
+
+    def _entry_path(self, file_path):
+        """
+        The cache entry path. The entry name includes a short hash of the
+        absolute source path so identically named files from different
+        directories don't collide.
+        """
+        file_path = pathlib.Path(file_path).resolve()
+        path_hash = hashlib.sha1(str(file_path).encode()).hexdigest()[:10]
+        return pathlib.Path(self.cache_dir, f'{file_path.stem}_{path_hash}.npz')
+
+    def _source_identity(self, file_path, source_hash=None):
+        """
+        The size, modification time, and (optionally) the hash of the
+        source file that identify a valid cache entry.
+        """
+        stat = os.stat(file_path)
+        source = {'size':stat.st_size, 'mtime_ns':stat.st_mtime_ns}
+        if self.validate_hash or (source_hash is not None):
+            source['sha1'] = self._file_hash(file_path)
+        return source
+
+    def _file_hash(self, file_path, block_size=2**20):
+        """
+        The SHA-1 hash of the source file.
+        """
+        file_hash = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                file_hash.update(block)
+        return file_hash.hexdigest()
+
+    def _evict(self):
+        """
+        Delete the least recently used entries until the cache is smaller
+        than self.max_size_gb.
+        """
+        entries = []
+        for entry_path in self.cache_dir.glob('*.npz'):
+            # Another process may delete the entry at any time.
+            try:
+                entries.append((entry_path, entry_path.stat()))
+            except FileNotFoundError:
+                continue
+        entries = sorted(entries, key=lambda entry: entry[1].st_mtime_ns)
+        cache_size = sum(stat.st_size for _, stat in entries)
+
+        for entry_path, stat in entries:
+            if cache_size <= self.max_size_gb*1E9:
+                break
+            entry_path.unlink(missing_ok=True)
+            cache_size -= stat.st_size
+        return
+
+    def __repr__(self):
+        params = (
+                f'cache_dir={self.cache_dir}, '
+                f'max_size_gb={self.max_size_gb}, '
+                f'validate_hash={self.validate_hash}'
+                )
+        return f'{self.__class__.__qualname__}(' + params + ')'
@@ -0,0 +1,270 @@
+# An index of the HiRes files in the FIREBIRD data directory.
+import bisect
+import json
+import os
+import pathlib
+import re
+
+import pandas as pd
+
+from microburst_detection.misc.load_firebird import readJSONheader, count_rows
+
+# Matches the HiRes file names, e.g. FU4_Hires_2019-09-27_L2.txt
+HIRES_NAME_PATTERN = re.compile(
+    r'FU(?P<sc_id>\d)_Hires_(?P<date>\d{4}-\d{2}-\d{2})_(?P<level>L\d)\.txt'
+    )
+
+class HiResManifest:
+    def __init__(self, fb_dir, manifest_path, refresh=True):
+        """
+        A persistent index of the FIREBIRD HiRes files that replaces the
+        pathlib.Path(config.FB_DIR).rglob() calls. The manifest records the
+        spacecraft, date, data level, path, size, and modification time of
+        every HiRes file and is saved to a json file.
+
+        The manifest is built once by walking fb_dir. A refresh only lists
+        the directories whose modification time changed since the last
+        refresh (i.e. files were added, removed, or renamed), and updates
+        the size and modification time of the files in the other
+        directories (e.g. files rewritten in place), so the cost of an
+        up-to-date manifest is one stat() call per directory and file.
+
+        Parameters
+        ----------
+        fb_dir : str or pathlib.Path
+            The FIREBIRD data directory.
+        manifest_path : str or pathlib.Path
+            The json file where the manifest is saved.
+        refresh : bool
+            Refresh the manifest when it is loaded.
+        """
+        self.fb_dir = pathlib.Path(fb_dir)
+        self.manifest_path = pathlib.Path(manifest_path)
+        self.dirs = {}
+
+        if self.manifest_path.exists():
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+            if manifest['fb_dir'] == str(self.fb_dir):
+                self.dirs = manifest['dirs']
+
+        if refresh or (not self.dirs):
+            self.refresh()
+        else:
+            self._build_index()
+        return
+
+    def refresh(self):
+        """
+        Rescan the directories that changed since the last refresh, and
+        save the manifest if anything changed.
+        """
+        dirs = {}
+        changed = self._scan_dir(self.fb_dir, dirs)
+        changed = changed or (dirs.keys() != self.dirs.keys())
+        self.dirs = dirs
+        self._build_index()
+
+        if changed:
+            self.save()
+        return
+
+    def save(self):
+        """
+        Save the manifest to self.manifest_path.
+        """
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'fb_dir':str(self.fb_dir), 'dirs':self.dirs}, f)
+        os.replace(tmp_path, self.manifest_path)
+        return
+
+    def path(self, sc_id, date, level='L2'):
+        """
+        Look up the HiRes file path for a spacecraft and date.
+
+        Parameters
+        ----------
+        sc_id : int
+            Spacecraft id. Either 3 or 4
+        date : str, datetime.date, datetime.datetime, or pd.Timestamp
+            The HiRes date.
+        level : str
+            The data level.
+
+        Returns
+        -------
+        pathlib.Path
+            The HiRes file path.
+        """
+        key = (int(sc_id), level)
+        date_str = self._date_str(date)
+        entries = self.index.get(key, {}).get(date_str, [])
+
+        if len(entries) == 0:
+            # The file may have been added since the last refresh.
+            self.refresh()
+            entries = self.index.get(key, {}).get(date_str, [])
+        if len(entries) != 1:
+            raise FileNotFoundError(
+                f'A unique HiRes path not found for FU{sc_id} on {date_str} '
+                f'in {self.fb_dir}. Found {[entry["path"] for entry in entries]}.'
+                )
+        return pathlib.Path(self.fb_dir, entries[0]['path'])
+
+    def paths(self, sc_id, start_date=None, end_date=None, level='L2'):
+        """
+        Find the HiRes file paths for a spacecraft between start_date and
+        end_date (inclusive), sorted by date.
+
+        Parameters
+        ----------
+        sc_id : int
+            Spacecraft id. Either 3 or 4
+        start_date, end_date : str, datetime.date, datetime.datetime, or pd.Timestamp
+            The date range. If None, the range is unbounded on that side.
+        level : str
+            The data level.
+
+        Returns
+        -------
+        list
+            A list of pathlib.Path HiRes file paths.
+        """
+        key = (int(sc_id), level)
+        dates = self.dates.get(key, [])
+
+        start_index = 0
+        end_index = len(dates)
+        if start_date is not None:
+            start_index = bisect.bisect_left(dates, self._date_str(start_date))
+        if end_date is not None:
+            end_index = bisect.bisect_right(dates, self._date_str(end_date))
+
+        return [pathlib.Path(self.fb_dir, entry['path'])
+                for date_str in dates[start_index:end_index]
+                for entry in self.index[key][date_str]]
+
+    def metadata(self, sc_id, start_date=None, end_date=None, level='L2',
+                row_counts=False):
+        """
+        Read the headers of the HiRes files between start_date and end_date
+        (see self.paths()) to plan the processing, e.g. to group the days by
+        cadence. Only the headers are read, unless row_counts=True.
+
+        Returns
+        -------
+        pd.DataFrame
+            A DataFrame with the date, path, CADENCE, and CAMPAIGN columns,
+            and a n_rows column if row_counts=True.
+        """
+        metadata = []
+        for hr_path in self.paths(sc_id, start_date, end_date, level=level):
+            attrs = readJSONheader(hr_path)
+            metadata.append({
+                'date':pd.Timestamp(HIRES_NAME_PATTERN.fullmatch(hr_path.name).group('date')),
+                'path':hr_path,
+                'CADENCE':attrs.get('CADENCE', float('nan')),
+                'CAMPAIGN':attrs.get('CAMPAIGN', float('nan'))
+                })
+            if row_counts:
+                metadata[-1]['n_rows'] = count_rows(hr_path)
+        columns = ['date', 'path', 'CADENCE', 'CAMPAIGN'] + (['n_rows'] if row_counts else [])
+        return pd.DataFrame(metadata, columns=columns)
+
+    def _scan_dir(self, dir_path, dirs):
+        """
+        Recursively scan dir_path. Directories that did not change since the
+        last refresh are copied from self.dirs without listing them, and
+        only their files are stat()'ed.
+
+        Returns True if any of the directories or files changed.
+        """
+        rel_dir = str(dir_path.relative_to(self.fb_dir))
+        mtime_ns = os.stat(dir_path).st_mtime_ns
+
+        files = None
+        if (rel_dir in self.dirs) and (self.dirs[rel_dir]['mtime_ns'] == mtime_ns):
+            files = self._stat_files(self.dirs[rel_dir]['files'])
+
+        if files is not None:
+            changed = files != self.dirs[rel_dir]['files']
+            dirs[rel_dir] = dict(self.dirs[rel_dir], files=files)
+        else:
+            changed = True
+            subdirs = []
+            files = []
+            with os.scandir(dir_path) as it:
+                for dir_entry in it:
+                    if dir_entry.is_dir():
+                        subdirs.append(dir_entry.name)
+                        continue
+                    match = HIRES_NAME_PATTERN.fullmatch(dir_entry.name)
+                    if match is None:
+                        continue
+                    stat = dir_entry.stat()
+                    files.append({
+                        'sc_id':int(match.group('sc_id')),
+                        'date':match.group('date'),
+                        'level':match.group('level'),
+                        'path':str(pathlib.Path(rel_dir, dir_entry.name)),
+                        'size':stat.st_size,
+                        'mtime_ns':stat.st_mtime_ns
+                        })
+            dirs[rel_dir] = {
+                'mtime_ns':mtime_ns, 'subdirs':sorted(subdirs), 'files':files
+                }
+
+        for subdir in dirs[rel_dir]['subdirs']:
+            changed = self._scan_dir(pathlib.Path(dir_path, subdir), dirs) or changed
+        return changed
+
+    def _stat_files(self, files):
+        """
+        Update the size and modification time of the files entries, e.g.
+        for the files that were rewritten in place. Returns None if a file
+        is missing, so its directory is listed again.
+        """
+        updated_files = []
+        for entry in files:
+            try:
+                stat = os.stat(pathlib.Path(self.fb_dir, entry['path']))
+            except FileNotFoundError:
+                return None
+            updated_files.append(dict(entry, size=stat.st_size, mtime_ns=stat.st_mtime_ns))
+        return updated_files
+
+    def _build_index(self):
+        """
+        Build the (sc_id, level) -> date -> entries index and the sorted
+        date lists for the date range queries.
+        """
+        self.index = {}
+        for dir_info in self.dirs.values():
+            for entry in dir_info['files']:
+                key = (entry['sc_id'], entry['level'])
+                self.index.setdefault(key, {}).setdefault(entry['date'], []).append(entry)
+
+        self.dates = {}
+        for key, date_entries in self.index.items():
+            for entries in date_entries.values():
+                entries.sort(key=lambda entry: entry['path'])
+            self.dates[key] = sorted(date_entries.keys())
+        return
+
+    def _date_str(self, date):
+        """
+        Convert the date to the YYYY-MM-DD format used in the file names.
+        """
+        return pd.Timestamp(date).strftime('%Y-%m-%d')
+
+    def __len__(self):
+        return sum(len(dir_info['files']) for dir_info in self.dirs.values())
+
+    def __repr__(self):
+        params = (
+                f'fb_dir={self.fb_dir}, '
+                f'manifest_path={self.manifest_path}'
+                )
+        return f'{self.__class__.__qualname__}(' + params + ')'
@@ -1,68 +1,430 @@
 # My own version of spacepy.datamodel.readJSONheadedASCII
+import functools
 import json
 
 import numpy as np
 import pandas as pd
 
+# A compact dtype schema for the HiRes columns: integer counts and single
+# precision ephemeris. The columns that are not in the schema are float64.
+COMPACT_DTYPES = {
+    'Col_counts':np.int32,
+    'Sur_counts':np.int32,
+    'Lat':np.float32,
+    'Lon':np.float32,
+    'Alt':np.float32,
+    'McIlwainL':np.float32,
+    'MLT':np.float32,
+    'kp':np.float32
+    }
 
-def readJSONheadedASCII(file_path):
+def readJSONheadedASCII(file_path, columns=None, dtypes=None, cache=None):
     """
     My simple implementation of spacepy.datamodel.readJSONheadedASCII that
-    is specific for FIREBIRD-II data. You may use this if you can't install 
+    is specific for FIREBIRD-II data. You may use this if you can't install
     spacepy for whatever reason.
+
+    The data block is parsed in one pass by pandas' C parser and the
+    columns are sliced out using the START_COLUMN and DIMENSION keys
+    in the JSON header.
+
+    Parameters
+    ----------
+    file_path : str or pathlib.Path
+        The HiRes file path.
+    columns : list
+        The column keys to parse, e.g. ['Col_counts']. Time is always
+        parsed. The other columns are not parsed until they are first
+        accessed (or loaded with HiRes.load()). If None, all columns are
+        parsed.
+    dtypes : dict
+        The column key: dtype pairs that the columns are parsed into,
+        e.g. COMPACT_DTYPES. The columns that are not in dtypes are
+        float64. An integer column raises a ValueError if the file
+        has non-integer (or NaN) values in it, with or without the cache.
+    cache : misc.hires_cache.HiResCache
+        An optional cache of the parsed HiRes files. If the file is
+        cached, the text file is not parsed. Otherwise all of the columns
+        are parsed and saved to the cache in float64 (so any columns and
+        dtypes can be loaded from it later), and then only the columns
+        are loaded from the new entry. The first pass over uncached files
+        is therefore slower than without the cache.
+    """
+    if cache is not None:
+        data = cache.load(file_path, columns=columns, dtypes=dtypes)
+        if data is None:
+            data = readJSONheadedASCII(file_path)
+            cache.save(file_path, data)
+            # Keep only the columns in memory, like a cache hit.
+            cached_data = cache.load(file_path, columns=columns, dtypes=dtypes)
+            if cached_data is None:
+                data.cast(dtypes)  # The entry was already evicted.
+            else:
+                data = cached_data
+        return data
+
+    parsed_header, n_header_lines = _read_header(file_path)
+    column_keys, columns = _select_columns(file_path, parsed_header, columns)
+
+    data = HiRes(
+        _read_columns(file_path, parsed_header, n_header_lines, ['Time'] + columns,
+                    dtypes=dtypes)
+        )
+    data.attrs = _parse_attrs(parsed_header)
+    data._lazy_columns = set(column_keys) - set(columns)
+    data._column_loader = functools.partial(
+        _read_columns, file_path, parsed_header, n_header_lines, dtypes=dtypes
+        )
+    return data
+
+def iterJSONheadedASCII(file_path, chunk_rows=100_000, columns=None, dtypes=None):
+    """
+    A streaming version of readJSONheadedASCII that parses the data block
+    in chunks of chunk_rows rows, so the memory is bounded regardless of
+    the file length.
+
+    Parameters
+    ----------
+    file_path : str or pathlib.Path
+        The HiRes file path.
+    chunk_rows : int
+        The number of rows in each chunk. The last chunk may be shorter.
+    columns : list
+        The column keys to parse, e.g. ['Col_counts']. Time is always
+        parsed. If None, all columns are parsed.
+    dtypes : dict
+        The column key: dtype pairs that the columns are parsed into,
+        e.g. COMPACT_DTYPES. See readJSONheadedASCII.
+
+    Returns
+    -------
+    attrs : dict
+        The header attributes, the same as HiRes.attrs.
+    chunks : generator
+        Yields a HiRes object with the Time and columns arrays for each
+        chunk of rows.
+    """
+    parsed_header, n_header_lines = _read_header(file_path)
+    _, columns = _select_columns(file_path, parsed_header, columns)
+    attrs = _parse_attrs(parsed_header)
+    chunks = _iter_chunks(
+        file_path, parsed_header, n_header_lines, ['Time'] + columns,
+        chunk_rows, attrs, dtypes
+        )
+    return attrs, chunks
+
+def _iter_chunks(file_path, parsed_header, n_header_lines, keys, chunk_rows,
+                attrs, dtypes):
+    """
+    The generator that parses the iterJSONheadedASCII chunks.
+    """
+    read_csv_kwargs, column_indices = _read_csv_kwargs(
+        parsed_header, n_header_lines, keys, dtypes=dtypes
+        )
+    reader = pd.read_csv(file_path, chunksize=chunk_rows, **read_csv_kwargs)
+    try:
+        for raw_data in reader:
+            chunk = HiRes(_split_columns(raw_data, column_indices, keys))
+            chunk.attrs = attrs
+            yield chunk
+    finally:
+        reader.close()
+    return
+
+def decode_times(times):
+    """
+    Decode the fixed-width FIREBIRD time stamps, e.g.
+    2019-09-27T19:30:30.012500, into datetime64[ns]. The date and time
+    fields are read directly from the character codes in one vectorized
+    pass. The rows that don't match the fixed-width layout of the first
+    row are parsed one at a time by pd.Timestamp.
+
+    Parameters
+    ----------
+    times : array-like
+        The time stamp strings.
+
+    Returns
+    -------
+    pd.DatetimeIndex
+        The datetime64[ns] times.
+    """
+    times_bytes = np.asarray(times).astype(bytes)
+    n = times_bytes.shape[0]
+    if n == 0:
+        return pd.DatetimeIndex(np.array([], dtype='datetime64[ns]'))
+
+    # The character codes of each row, padded with zeros to the longest row.
+    item_size = times_bytes.dtype.itemsize
+    raw_chars = np.frombuffer(times_bytes.tobytes(), dtype=np.uint8).reshape(n, item_size)
+    width = len(times_bytes[0])
+    n_fraction = width-20  # The digits after the decimal point.
+    if (width < 19) or (n_fraction > 9):
+        return pd.DatetimeIndex([pd.Timestamp(t.decode()) for t in times_bytes])
+
+    # Check that every row has the YYYY-MM-DDTHH:MM:SS.ffffff layout.
+    # Transposing makes each character column contiguous.
+    chars = np.ascontiguousarray(raw_chars[:, :width].T)
+    digits = chars - np.uint8(ord('0'))  # Non-digits wrap around to > 9.
+    valid = chars[width-1] != 0
+    if item_size > width:
+        valid &= raw_chars[:, width] == 0
+    separators = {4:'-', 7:'-', 10:'T', 13:':', 16:':', 19:'.'}
+    for i in range(width):
+        if i in separators:
+            valid &= chars[i] == ord(separators[i])
+        else:
+            valid &= digits[i] <= 9
+
+    def field(start, end):
+        # The integer value of the digits in the start:end characters.
+        value = digits[start].astype(np.int64)
+        for i in range(start+1, end):
+            value *= 10
+            value += digits[i]
+        return value
+
+    year = field(0, 4)
+    month = field(5, 7)
+    day = field(8, 10)
+    month_start = (
+        12*(year-1970) + np.clip(month, 1, 12) - 1
+        ).astype('datetime64[M]')
+    days_in_month = ((month_start+1).astype('datetime64[D]') -
+                    month_start.astype('datetime64[D]')).astype(np.int64)
+    valid &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= days_in_month)
+    hour = field(11, 13)
+    minute = field(14, 16)
+    second = field(17, 19)
+    valid &= (hour <= 23) & (minute <= 59) & (second <= 59)
+
+    nanoseconds = (3600*hour + 60*minute + second)*10**9
+    if n_fraction > 0:
+        nanoseconds += field(20, width)*10**(9-n_fraction)
+
+    decoded_times = (
+        month_start.astype('datetime64[ns]') +
+        (day-1).astype('timedelta64[D]') +
+        nanoseconds.astype('timedelta64[ns]')
+        )
+
+    # Fall back to the generic parser for the malformed rows.
+    if not np.all(valid):
+        invalid_idx = np.where(~valid)[0]
+        decoded_times[invalid_idx] = [
+            pd.Timestamp(times_bytes[i].decode()).to_datetime64()
+            for i in invalid_idx
+            ]
+    return pd.DatetimeIndex(decoded_times)
+
+def readJSONheader(file_path):
+    """
+    Read only the JSON header of a HiRes file, e.g. to find the cadence,
+    campaign, or the column layout without parsing the data block.
+
+    Parameters
+    ----------
+    file_path : str or pathlib.Path
+        The HiRes file path.
+
+    Returns
+    -------
+    dict
+        The header attributes, the same as HiRes.attrs returned by
+        readJSONheadedASCII.
+    """
+    parsed_header, _ = _read_header(file_path)
+    return _parse_attrs(parsed_header)
+
+def count_rows(file_path, block_size=2**20):
+    """
+    Count the number of data rows in a HiRes file by counting the
+    newlines in binary blocks, without parsing the rows.
+    """
+    _, n_header_lines = _read_header(file_path)
+    n_lines = 0
+    last_block = b''
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            n_lines += block.count(b'\n')
+            last_block = block
+    # The last row may not end with a newline.
+    if len(last_block) and (not last_block.endswith(b'\n')):
+        n_lines += 1
+    return n_lines - n_header_lines
+
+def _read_columns(file_path, parsed_header, n_header_lines, keys, dtypes=None):
+    """
+    Parse the keys columns from the HiRes data block.
+
+    Returns
+    -------
+    dict
+        The key: array pairs for each key in keys.
+    """
+    read_csv_kwargs, column_indices = _read_csv_kwargs(
+        parsed_header, n_header_lines, keys, dtypes=dtypes
+        )
+    raw_data = pd.read_csv(file_path, **read_csv_kwargs)
+    return _split_columns(raw_data, column_indices, keys)
+
+def _read_csv_kwargs(parsed_header, n_header_lines, keys, dtypes=None):
+    """
+    Use the START_COLUMN and DIMENSION header keys to make the pd.read_csv
+    kwargs that parse only the keys columns.
+
+    Returns
+    -------
+    read_csv_kwargs : dict
+        The pd.read_csv kwargs.
+    column_indices : dict
+        The data block column indices for each key.
+    """
+    n_columns = _number_of_columns(parsed_header)
+
+    # The 0th column is always the time stamp.
+    column_indices = {'Time':[0]}
+    for key in keys:
+        if key == 'Time':
+            continue
+        start_column = parsed_header[key]['START_COLUMN']
+        end_column = parsed_header[key]['START_COLUMN']+parsed_header[key]['DIMENSION'][0]
+        column_indices[key] = list(range(start_column, end_column))
+    use_columns = sorted({i for key in keys for i in column_indices[key]})
+    column_dtypes = {
+        i:_column_dtype(key, dtypes) for key in keys for i in column_indices[key]
+        }
+    column_dtypes[0] = str
+
+    read_csv_kwargs = {
+        'sep':r'\s+', 'header':None, 'skiprows':n_header_lines,
+        'names':range(n_columns), 'usecols':use_columns,
+        'dtype':column_dtypes, 'engine':'c'
+        }
+    return read_csv_kwargs, column_indices
+
+def _column_dtype(key, dtypes):
+    """
+    The dtype of the key column in the dtypes schema (float64 by default).
+    """
+    if (dtypes is None) or (key not in dtypes):
+        return np.float64
+    return dtypes[key]
+
+def _cast_column(key, values, dtypes):
+    """
+    Convert the key column values to its dtype in the dtypes schema. An
+    integer dtype raises a ValueError if the values are not all finite
+    integers, like the parser does, instead of silently truncating them.
+    """
+    dtype = _column_dtype(key, dtypes)
+    if (np.issubdtype(dtype, np.integer) and
+            np.issubdtype(values.dtype, np.floating)):
+        if not np.all(np.isfinite(values) & (np.mod(values, 1) == 0)):
+            raise ValueError(
+                f'cannot safely convert the {key} column to {np.dtype(dtype)}, '
+                'it has non-integer values.'
+                )
+    return values.astype(dtype, copy=False)
+
+def _split_columns(raw_data, column_indices, keys):
+    """
+    Split the parsed data block DataFrame into the keys arrays.
+    """
+    data = {}
+    for key in keys:
+        if key == 'Time':
+            data[key] = decode_times(raw_data[0].to_numpy())
+        elif len(column_indices[key]) == 1:
+            data[key] = raw_data[column_indices[key][0]].to_numpy()
+        else:
+            data[key] = raw_data.loc[:, column_indices[key]].to_numpy()
+    return data
+
+def _select_columns(file_path, parsed_header, columns):
+    """
+    Check that the columns are in the header.
+
+    Returns
+    -------
+    column_keys : list
+        All column keys in the header, except Time.
+    columns : list
+        The requested column keys (all column_keys if columns is None),
+        in the header order.
+    """
+    column_keys = [key for key, key_header in parsed_header.items()
+                    if isinstance(key_header, dict) and (key != 'Time')]
+    if columns is None:
+        columns = column_keys
+    unknown_columns = set(columns) - set(column_keys) - {'Time'}
+    if len(unknown_columns):
+        raise ValueError(
+            f'The {unknown_columns} columns are not in {file_path}. '
+            f'The columns are {column_keys}.'
+            )
+    columns = [key for key in column_keys if key in columns]
+    return column_keys, columns
+
+def _parse_attrs(parsed_header):
+    """
+    Make the attribute dictionary from the JSON header. The CADENCE
+    and CAMPAIGN attributes are converted to floats.
+    """
+    attrs = {}
+    for key, key_header in parsed_header.items():
+        if key in ['CADENCE', 'CAMPAIGN']:
+            attrs[key] = float(key_header)
+        else:
+            attrs[key] = key_header
+    return attrs
+
+def _read_header(file_path):
+    """
+    Read and parse the JSON header (the lines starting with a "#").
+
+    Returns
+    -------
+    parsed_header : dict
+        The parsed JSON header.
+    n_header_lines : int
+        The number of header lines, i.e. the line number where
+        the data block starts.
     """
-    # Read in the JSON header.
     header_list = []
     with open(file_path, 'r') as f:
         for line in f:
-            if line.startswith('#'):
-                header_list.append(line[1:])
-            else:
-                raw_data_str = f.readlines()
+            if not line.startswith('#'):
+                break
+            header_list.append(line[1:])
 
-    # Massage the header
     clean_header_str = ''.join(header_list).replace('\n', '')
     parsed_header = json.loads(clean_header_str)
-    # Massage the data
-    raw_data_str = [row.replace('\n', '') for row in raw_data_str]
-    # Parse times
-    times_str = [row.split()[0] for row in raw_data_str]
-    # Parse the other columns
-    data_converted = np.array([row.split()[1:] for row in raw_data_str]).astype(float)
-
-    data = HiRes()
-    data['Time'] = pd.to_datetime(times_str)
-    for key in parsed_header:
-        key_header = parsed_header[key]
-        data.attrs[key] = key_header  # Save the attribute data.
-
-        if key == 'Time':  # We already added Time.
+    return parsed_header, len(header_list)
+
+def _number_of_columns(parsed_header):
+    """
+    Use the START_COLUMN and DIMENSION header keys to find the
+    number of columns in the data block (including the time column).
+    """
+    n_columns = 1
+    for key, key_header in parsed_header.items():
+        if not isinstance(key_header, dict):
             continue
-        # Header key that correspond to columns
-        if isinstance(key_header, dict):
-            if len(key_header['DIMENSION']) != 1:
-                raise NotImplementedError(
-                    "readJSONheadedASCII doesn't implement columns with more than "
-                    f"1 multidimensional. Got {key_header['DIMENSION']}."
-                    )
-            start_column = key_header['START_COLUMN']-1
-            end_column = key_header['START_COLUMN']-1+key_header['DIMENSION'][0]
-            if key_header['DIMENSION'][0] == 1:
-                data[key] = data_converted[:, start_column]
-            else:
-                data[key] = data_converted[:, start_column:end_column]
-        else:
-            # Header key that correspond to global attributes
-            if key in ['CADENCE', 'CAMPAIGN']:
-                data.attrs[key] = float(key_header)
-            else:
-                data.attrs[key] = key_header
-    return data
+        if len(key_header['DIMENSION']) != 1:
+            raise NotImplementedError(
+                "readJSONheadedASCII doesn't implement columns with more than "
+                f"1 multidimensional. Got {key_header['DIMENSION']}."
+                )
+        n_columns = max(
+            n_columns, key_header['START_COLUMN']+key_header['DIMENSION'][0]
+            )
+    return n_columns
 
 class HiRes(dict):
     """
     Expand Python's dict class to include an attr attribute dictionary.
-    
+
     Code credit goes to Matt Anderson:
     https://stackoverflow.com/questions/2390827/how-to-properly-subclass-dict-and-override-getitem-setitem
     (blame him for problems)
@@ -70,4 +432,90 @@ class HiRes(dict):
     def __init__(self, *args, **kwargs):
         self.update(*args, **kwargs)
         self.attrs = {}
+        # The columns that were not parsed yet, and a function that
+        # parses a list of them.
+        self._lazy_columns = set()
+        self._column_loader = None
         return
+
+    def __missing__(self, key):
+        """
+        Parse a lazy column the first time it is accessed.
+        """
+        if key not in self._lazy_columns:
+            raise KeyError(key)
+        self.load([key])
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        """
+        The lazy columns are in the HiRes data too, even though they are
+        not in keys() until they are parsed.
+        """
+        return dict.__contains__(self, key) or (key in self._lazy_columns)
+
+    def get(self, key, default=None):
+        """
+        The same as dict.get, but a lazy column is parsed and returned.
+        """
+        if key in self:
+            return self[key]
+        return default
+
+    def cast(self, dtypes):
+        """
+        Convert the parsed columns to the dtypes schema in place, and
+        make the lazy columns parse into it (see readJSONheadedASCII).
+        """
+        for key in self.keys():
+            if key != 'Time':
+                self[key] = _cast_column(key, self[key], dtypes)
+        if self._column_loader is not None:
+            self._column_loader = functools.partial(self._column_loader, dtypes=dtypes)
+        return
+
+    def load(self, keys):
+        """
+        Parse the lazy columns in keys at once. This is faster than
+        accessing them one at a time.
+        """
+        keys = [key for key in keys if key in self._lazy_columns]
+        if len(keys):
+            self.update(self._column_loader(keys))
+            self._lazy_columns.difference_update(keys)
+        return
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    def _readJSONheadedASCII_rowwise(file_path):
+        """
+        The original row-by-row parser, kept here only as a benchmark
+        reference.
+        """
+        _, n_header_lines = _read_header(file_path)
+        with open(file_path, 'r') as f:
+            raw_data_str = f.readlines()[n_header_lines:]
+        raw_data_str = [row.replace('\n', '') for row in raw_data_str]
+        times_str = [row.split()[0] for row in raw_data_str]
+        data_converted = np.array([row.split()[1:] for row in raw_data_str]).astype(float)
+        return pd.to_datetime(times_str), data_converted
+
+    # Benchmark the parser on a (full-day) HiRes file given as an argument,
+    # e.g. python3 load_firebird.py FU4_Hires_2019-09-27_L2.txt
+    hr_path = sys.argv[1]
+
+    t0 = time.perf_counter()
+    times, data_converted = _readJSONheadedASCII_rowwise(hr_path)
+    t_rowwise = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    hr = readJSONheadedASCII(hr_path)
+    t_vectorized = time.perf_counter() - t0
+
+    assert np.all(hr['Time'] == times), 'The parsed times do not match.'
+    print(f'Parsed {len(times)} rows from {hr_path}')
+    print(f'Row-wise parser:   {t_rowwise:.2f} s')
+    print(f'Vectorized parser: {t_vectorized:.2f} s ({t_rowwise/t_vectorized:.1f}x faster)')
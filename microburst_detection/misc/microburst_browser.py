@@ -4,11 +4,12 @@ import matplotlib.pyplot as plt
 from matplotlib.dates import date2num, num2date
 import pandas as pd
 from datetime import date, datetime, timedelta
-import dateutil.parser
 from matplotlib.widgets import Button, TextBox
 import pathlib
 
-from microburst_detection.misc.load_firebird import readJSONheadedASCII
+from microburst_detection.misc.load_firebird import readJSONheadedASCII, COMPACT_DTYPES
+from microburst_detection.misc.hires_cache import HiResCache
+from microburst_detection.misc.hires_manifest import HiResManifest
 from microburst_detection import config
 
 class Browser:
@@ -28,6 +29,12 @@ class Browser:
         """
         self.fb_id = fb_id
         self.plot_width = plot_width
+        self.hr_cache = HiResCache(
+            pathlib.Path(config.PROJECT_DIR, 'data', 'hires_cache')
+            )
+        self.manifest = HiResManifest(
+            config.FB_DIR, pathlib.Path(config.PROJECT_DIR, 'data', 'hires_manifest.json')
+            )
 
         self.load_catalog(catalog_name=catalog_name)
         self.filter_catalog(filterDict=filterDict)
@@ -259,15 +266,12 @@ class Browser:
         return
 
     def _load_hr(self, date):
-        """ Loads FIREBIRD HiRes data and converts times """
-        search_str = f'FU{self.fb_id}_Hires_{date}_L2.txt'
-        hr_paths = list(pathlib.Path(config.FB_DIR).rglob(search_str))
-        assert len(hr_paths) == 1, (f'A unique HiRes path not found.\n'
-                                    f'hr_paths={hr_paths} search_str={search_str}')
-        hr_path = str(hr_paths[0])
-        self.hr = readJSONheadedASCII(hr_path)
-        self.hr['Time'] = pd.to_datetime(self.hr['Time'])
-        #self.hr['Time'] = np.array([dateutil.parser.parse(t) for t in self.hr['Time']])
+        """ Loads FIREBIRD HiRes data """
+        hr_path = self.manifest.path(self.fb_id, date)
+        self.hr = readJSONheadedASCII(
+            hr_path, columns=['Col_counts'], dtypes=COMPACT_DTYPES,
+            cache=self.hr_cache
+            )
         self.cadence = 1000*float(self.hr.attrs['CADENCE'])
         return
 
@@ -0,0 +1,84 @@
+# Benchmark the cumulative sum running averages in SignalToBackground
+# against the pandas rolling().mean() running averages on a full day of
+# HiRes data, e.g. python3 running_average_benchmark.py 4 2019-09-27
+import pathlib
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from microburst_detection import config
+from microburst_detection.misc.load_firebird import readJSONheadedASCII
+from microburst_detection.misc.hires_manifest import HiResManifest
+from microburst_detection.signal_to_background.signal_to_background import \
+    SignalToBackground, FirebirdSignalToBackground
+
+def pandas_significance(counts, cadence, background_width_s, microburst_width_s):
+    """
+    The pandas SignalToBackground.significance() implementation, kept here
+    only as a benchmark reference.
+    """
+    counts = pd.DataFrame(counts)
+    microburst_rolling_average = counts.rolling(
+        int(microburst_width_s/cadence), center=True).mean()
+    background_rolling_average = counts.rolling(
+        int(background_width_s/cadence), center=True).mean()
+    diff = (microburst_rolling_average-background_rolling_average)
+    return diff/np.sqrt(background_rolling_average+1)
+
+def pandas_firebird_significance(counts, cadence, background_width_s):
+    """
+    The pandas FirebirdSignalToBackground.significance() implementation,
+    kept here only as a benchmark reference.
+    """
+    counts = pd.DataFrame(counts)
+    rolling_average = counts.rolling(int(background_width_s/cadence), center=True).mean()
+    return (counts - rolling_average)/np.sqrt(rolling_average+1)
+
+def best_time(func, n_repeats=5):
+    """
+    The fastest run time of func() in seconds.
+    """
+    run_times = []
+    for _ in range(n_repeats):
+        t0 = time.perf_counter()
+        func()
+        run_times.append(time.perf_counter() - t0)
+    return min(run_times)
+
+if __name__ == '__main__':
+    background_width_s = 0.5
+    microburst_width_s = 0.1
+
+    sc_id = int(sys.argv[1])
+    manifest = HiResManifest(
+        config.FB_DIR, pathlib.Path(config.PROJECT_DIR, 'data', 'hires_manifest.json')
+        )
+    hr = readJSONheadedASCII(manifest.path(sc_id, sys.argv[2]), columns=['Col_counts'])
+    cadence = float(hr.attrs['CADENCE'])
+    counts = hr['Col_counts']
+    print(f'Benchmarking on {counts.shape[0]} x {counts.shape[1]} Col_counts.')
+
+    s = SignalToBackground(counts, cadence, background_width_s, microburst_width_s)
+    fb = FirebirdSignalToBackground(counts, cadence, background_width_s, microburst_width_s)
+    benchmarks = {
+        'SignalToBackground':(
+            s.significance,
+            lambda: pandas_significance(counts, cadence, background_width_s,
+                                        microburst_width_s)
+            ),
+        'FirebirdSignalToBackground':(
+            fb.significance,
+            lambda: pandas_firebird_significance(counts, cadence, background_width_s)
+            )
+        }
+
+    for name, (numpy_func, pandas_func) in benchmarks.items():
+        assert np.allclose(numpy_func(), pandas_func().to_numpy(), equal_nan=True), \
+            f'The {name} significance does not match.'
+        t_numpy = best_time(numpy_func)
+        t_pandas = best_time(pandas_func)
+        print(f'{name}.significance()')
+        print(f'\tpandas rolling:  {t_pandas*1E3:.1f} ms')
+        print(f'\tcumulative sum:  {t_numpy*1E3:.1f} ms ({t_pandas/t_numpy:.1f}x faster)')
@@ -7,10 +7,11 @@ import pandas as pd
 
 from microburst_detection import config
 from microburst_detection.misc.load_firebird import readJSONheadedASCII
-from microburst_detection.misc.locate_consecutive_numbers import locateConsecutiveNumbers
+from microburst_detection.misc.hires_manifest import HiResManifest
 
 class SignalToBackground:
-    def __init__(self, counts, cadence, background_width_s, microburst_width_s):
+    def __init__(self, counts, cadence, background_width_s, microburst_width_s,
+                times=None, max_time_gap=None, background='mean'):
         """ 
         This class implements the signal to background 
         microburst detection. This method is a generalization 
@@ -24,7 +25,8 @@ class SignalToBackground:
         Parameters
         ----------
         counts : array
-            Array of counts. Should be continuous
+            Array of counts. Should be continuous. Either 1d (nTime) or 
+            2d (nTime x nChannel).
         cadence : float
             Instrument cadence (seconds)
         microburst_width_s : float
@@ -33,16 +35,44 @@ class SignalToBackground:
         background_width_s : float
             The baseline width in seconds to calculate the running mean,
             i.e. the a500 parameter in the O'Brien paper.
+        times : array
+            The optional counts time stamps. If given, the counts are split 
+            into continuous segments at the time gaps, and the running 
+            averages are NaN where the window spans a gap.
+        max_time_gap : float
+            The minimum time difference in seconds between consecutive time 
+            stamps that is a time gap. 5*cadence if None, the same as the time_gap
+            catalog flag, so the normal time stamp jitter (e.g. 30 ms steps
+            at 18.75 ms cadence) is not a gap.
+        background : str or float
+            The background estimator over background_width_s. Either 
+            'mean', 'median', or a percentile between 0 and 100. The median
+            and percentiles are less biased by bright microbursts in the
+            background window than the mean.
         """
-        self.counts = counts
-
-        # Check that counts is a DataFrame
-        if not isinstance(self.counts, pd.DataFrame):
-            self.counts = pd.DataFrame(self.counts)
-
+        # No copy is made if counts is already an array.
+        self.counts = np.asarray(counts)
         self.cadence = cadence
         self.background_width_s = background_width_s
         self.microburst_width_s = microburst_width_s
+        self.max_time_gap = max_time_gap
+        self.background = background
+
+        if self.background == 'mean':
+            self._background_quantile = None
+        elif self.background == 'median':
+            self._background_quantile = 0.5
+        elif np.issubdtype(type(self.background), np.number) and (0 <= self.background <= 100):
+            self._background_quantile = self.background/100
+        else:
+            raise ValueError(f'background must be "mean", "median", or a '
+                             f'percentile between 0 and 100, not {background}.')
+
+        self.segment_id = None
+        if times is not None:
+            if self.max_time_gap is None:
+                self.max_time_gap = 5*self.cadence
+            self.segment_id = _segment_id(times, self.max_time_gap)
         return
 
     def significance(self):
@@ -51,19 +81,66 @@ class SignalToBackground:
         assuming Poisson statistics, that a count value is above
         a rolling average background of length self.background_width_s.
 
-        Returns a pandas DataFrame object that can be 
-        converted to numpy using .to_numpy() method.
+        Returns a numpy array with the same shape as counts.
         """
-        self.microburst_rolling_average = self._running_average(self.counts, 
-            self.microburst_width_s)
-        self.background_rolling_average = self._running_average(self.counts, 
-            self.background_width_s)
-        
-        diff = (self.microburst_rolling_average-self.background_rolling_average)
-        self.n_std = diff/np.sqrt(self.background_rolling_average+1)
+        self._cumulative_counts = _cumulative_sum(self.counts)
+        self.n_std = self._significance(self.background_width_s, 
+                                        self.microburst_width_s)
         return self.n_std
 
-    def find_microburst_peaks(self, std_thresh=2):
+    def significance_grid(self, width_pairs):
+        """
+        Calculate the significance for many (background_width_s, 
+        microburst_width_s) pairs from one cumulative sum of the counts, 
+        e.g. to compare the O'Brien 0.5 s and 0.1 s widths to longer 
+        backgrounds. The widths passed to __init__ are not used.
+
+        Parameters
+        ----------
+        width_pairs : list
+            A list of (background_width_s, microburst_width_s) tuples.
+
+        Returns
+        -------
+        np.array
+            The significance stack with shape (len(width_pairs),) + 
+            counts.shape. It is also saved to self.n_std_grid.
+        """
+        self.width_pairs = list(width_pairs)
+        self._cumulative_counts = _cumulative_sum(self.counts)
+        self.n_std_grid = np.empty((len(self.width_pairs),) + self.counts.shape)
+
+        for i, (background_width_s, microburst_width_s) in enumerate(self.width_pairs):
+            self.n_std_grid[i] = self._significance(background_width_s, 
+                                                    microburst_width_s)
+        return self.n_std_grid
+
+    def find_microburst_peaks_grid(self, std_thresh=2, return_intervals=False):
+        """
+        Find the microburst peaks for every width pair in the 
+        significance_grid() stack.
+
+        Parameters
+        ----------
+        std_thresh : float
+            The baseline standard deviation threshold above the baseline
+            that the data point must be to satisfy the microburst criteria
+        return_intervals : bool
+            If True, return the (peak_idt, interval_start_idt, 
+            interval_end_idt, interval_duration_s) tuple for every width 
+            pair, like find_microburst_peaks.
+
+        Returns
+        -------
+        list
+            The peak indices for each width pair, in the width_pairs 
+            order. A width pair with no detections has an empty array.
+        """
+        return [self._multi_threshold_peaks(n_std, self.counts, [std_thresh], 
+                                            return_intervals)[std_thresh]
+                for n_std in self.n_std_grid]
+
+    def find_microburst_peaks(self, std_thresh=2, return_intervals=False):
         """
         This method finds the data intervals where the 
         microburst criteria is satisfied. Then for
@@ -75,39 +152,152 @@ class SignalToBackground:
         std_thresh : float
             The baseline standard deviation threshold above the baseline
             that the data point must be to satisfy the microburst criteria
+        return_intervals : bool
+            If True, also return the interval start and end indices 
+            (inclusive), and the interval durations in seconds.
+
+        Returns
+        -------
+        np.array or tuple
+            The peak indices, or (peak_idt, interval_start_idt, 
+            interval_end_idt, interval_duration_s) if return_intervals=True.
         """
         self.criteria_idt = np.where(self.n_std >= std_thresh)[0]
 
         if len(self.criteria_idt) <= 1:
             raise ValueError('No detections found')
 
-        interval_start, interval_end = locateConsecutiveNumbers(self.criteria_idt)
-        self.peak_idt = np.nan*np.ones(interval_start.shape[0])
-
-        # Loop over each continous interval and find the peak index.
-        for i, (start, end) in enumerate(zip(interval_start, interval_end)):
-            if start == end:
-                end+=1
-            offset = self.criteria_idt[start]
-            self.peak_idt[i] = offset + np.argmax(self.counts.loc[self.criteria_idt[start:end]])
-        self.peak_idt = self.peak_idt.astype(int)
+        intervals = self._interval_peaks(self.counts, self.criteria_idt)
+        (self.peak_idt, self.interval_start_idt, self.interval_end_idt, 
+            self.interval_duration_s) = intervals
+        if return_intervals:
+            return intervals
         return self.peak_idt
 
-    def _running_average(self, counts, time_window_s):
+    def find_microburst_peaks_multi(self, std_threshs, return_intervals=False):
+        """
+        Find the microburst peaks for a list of thresholds from one 
+        significance() call. Since the intervals above a higher threshold
+        are nested inside the intervals above a lower threshold, every
+        threshold only tests the samples that passed the previous (lower)
+        threshold.
+
+        Parameters
+        ----------
+        std_threshs : list
+            The baseline standard deviation thresholds.
+        return_intervals : bool
+            If True, return the (peak_idt, interval_start_idt, 
+            interval_end_idt, interval_duration_s) tuple for every 
+            threshold, like find_microburst_peaks.
+
+        Returns
+        -------
+        dict
+            The std_thresh -> peak indices dictionary, in the std_threshs
+            order. A threshold with no detections maps to an empty array.
+        """
+        return self._multi_threshold_peaks(self.n_std, self.counts, std_threshs, 
+                                        return_intervals)
+
+    def _multi_threshold_peaks(self, n_std, counts, std_threshs, return_intervals):
+        """
+        Find the interval peaks for each threshold in std_threshs, starting
+        with the lowest.
+        """
+        peaks = {}
+        criteria_idt = None
+        for std_thresh in sorted(set(std_threshs)):
+            if criteria_idt is None:
+                criteria_idt = np.where(n_std >= std_thresh)[0]
+            else:
+                criteria_idt = criteria_idt[n_std[criteria_idt] >= std_thresh]
+
+            if len(criteria_idt) <= 1:
+                # The same "No detections found" criteria as find_microburst_peaks.
+                empty_idt = np.array([], dtype=int)
+                intervals = (empty_idt, empty_idt, empty_idt, np.array([]))
+            else:
+                intervals = self._interval_peaks(counts, criteria_idt)
+            peaks[std_thresh] = intervals if return_intervals else intervals[0]
+        return {std_thresh:peaks[std_thresh] for std_thresh in std_threshs}
+
+    def _interval_peaks(self, counts, criteria_idt):
+        """
+        Find the consecutive intervals in criteria_idt and the index of the 
+        largest counts value in each interval. Ties go to the first index, 
+        like np.argmax.
+
+        Returns
+        -------
+        tuple
+            The (peak_idt, interval_start_idt, interval_end_idt, 
+            interval_duration_s) arrays.
+        """
+        # The positions in criteria_idt where a new interval starts.
+        interval_start = np.flatnonzero(np.diff(criteria_idt, prepend=-2) != 1)
+        interval_length = np.diff(interval_start, append=len(criteria_idt))
+        interval_start_idt = criteria_idt[interval_start]
+        interval_end_idt = interval_start_idt + interval_length - 1
+        interval_duration_s = interval_length*self.cadence
+
+        # Segmented argmax: mark the samples equal to their interval's 
+        # maximum and take the first marked position in every interval.
+        interval_counts = counts[criteria_idt]
+        interval_max = np.repeat(np.maximum.reduceat(interval_counts, interval_start), 
+                                interval_length)
+        is_max = interval_counts == interval_max
+        if np.issubdtype(interval_counts.dtype, np.floating):
+            # np.argmax returns the first NaN.
+            is_max |= np.isnan(interval_counts)
+        max_position = np.where(is_max, np.arange(len(criteria_idt)), 
+                                len(criteria_idt))
+        peak_idt = criteria_idt[np.minimum.reduceat(max_position, interval_start)]
+        return peak_idt, interval_start_idt, interval_end_idt, interval_duration_s
+
+    def _significance(self, background_width_s, microburst_width_s):
+        """
+        Calculate the significance for one pair of widths from the 
+        cumulative counts. The running averages are saved as attributes.
+        """
+        self.microburst_rolling_average = self._running_average(microburst_width_s)
+        self.background_rolling_average = self._running_background(background_width_s)
+
+        n_std = self.microburst_rolling_average-self.background_rolling_average
+        n_std /= np.sqrt(self.background_rolling_average+1)
+        return n_std
+
+    def _running_background(self, time_window_s):
         """
-        Calculate the running average of the counts array.
+        Calculate the centered running background with the self.background
+        estimator.
         """
-        background_width_samples = int(time_window_s/self.cadence)
-        return counts.rolling(background_width_samples, center=True).mean()
+        if self._background_quantile is None:
+            return self._running_average(time_window_s)
+        window_samples = int(time_window_s/self.cadence)
+        return _centered_quantile(self.counts, window_samples, 
+                                self._background_quantile, 
+                                segment_id=self.segment_id)
+
+    def _running_average(self, time_window_s):
+        """
+        Calculate the centered running average of the counts array
+        from the cumulative counts.
+        """
+        window_samples = int(time_window_s/self.cadence)
+        return _centered_mean(self._cumulative_counts, window_samples, 
+                            segment_id=self.segment_id)
 
 
 class FirebirdSignalToBackground(SignalToBackground):
-    def __init__(self, counts, cadence, background_width_s, microburst_width_s):
+    def __init__(self, counts, cadence, background_width_s, microburst_width_s,
+                times=None, max_time_gap=None, background='mean'):
         """
         This child class of SignalToBackground finds peaks but reports
         the standard deviations for all 6 FIREBIRD channels.
         """
-        super().__init__(counts, cadence, background_width_s, microburst_width_s)
+        super().__init__(counts, cadence, background_width_s, microburst_width_s,
+                        times=times, max_time_gap=max_time_gap, background=background)
         return
 
     def significance(self):
@@ -117,43 +307,171 @@ class FirebirdSignalToBackground(SignalToBackground):
         background of length self.background_width_s. Does this for the
         6 FIREBIRD channels.
 
-        Returns a pandas DataFrame object that can be 
-        converted to numpy using .to_numpy() method.
+        Returns a nTime x nChannel numpy array.
         """
-        self.rolling_average = self._running_average(self.counts)
-        self.n_std = np.subtract(self.counts, self.rolling_average)/np.sqrt(self.rolling_average+1)
+        self._cumulative_counts = _cumulative_sum(self.counts)
+        self.n_std = self._significance(self.background_width_s, 
+                                        self.microburst_width_s)
         return self.n_std
 
-    def find_microburst_peaks(self, std_thresh=2, detect_channel=0):
+    def find_microburst_peaks(self, std_thresh=2, detect_channel=0, 
+                            return_intervals=False):
         """
         This method finds the data intervals where the 
         microburst criteria is satisfied. For for 
         every interval, calculate the time of the highest
         peak.
+
+        Parameters
+        ----------
+        std_thresh : float
+            The baseline standard deviation threshold above the baseline
+            that the data point must be to satisfy the microburst criteria
+        detect_channel : int
+            The channel used to find the microbursts.
+        return_intervals : bool
+            If True, also return the interval start and end indices 
+            (inclusive), and the interval durations in seconds.
         """
-        self.criteria_idt = np.where(self.n_std.loc[:, detect_channel] >= std_thresh)[0]
+        self.criteria_idt = np.where(self.n_std[:, detect_channel] >= std_thresh)[0]
 
         if len(self.criteria_idt) <= 1:
             raise ValueError('No detections found')
 
-        interval_start, interval_end = locateConsecutiveNumbers(self.criteria_idt)
-        self.peak_idt = np.nan*np.ones(interval_start.shape[0])
-
-        # Loop over each continuos interval and find the peak index.
-        for i, (start, end) in enumerate(zip(interval_start, interval_end)):
-            if start == end:
-                end+=1
-            offset = self.criteria_idt[start]
-            self.peak_idt[i] = offset + np.argmax(self.counts.loc[self.criteria_idt[start:end], detect_channel])
-        self.peak_idt = self.peak_idt.astype(int)
+        intervals = self._interval_peaks(self.counts[:, detect_channel], 
+                                        self.criteria_idt)
+        (self.peak_idt, self.interval_start_idt, self.interval_end_idt, 
+            self.interval_duration_s) = intervals
+        if return_intervals:
+            return intervals
         return self.peak_idt
 
-    def _running_average(self, counts):
+    def find_microburst_peaks_multi(self, std_threshs, detect_channel=0, 
+                                    return_intervals=False):
+        """
+        Find the microburst peaks in the detect_channel for a list of 
+        thresholds from one significance() call. See
+        SignalToBackground.find_microburst_peaks_multi.
+        """
+        return self._multi_threshold_peaks(self.n_std[:, detect_channel], 
+                                        self.counts[:, detect_channel], 
+                                        std_threshs, return_intervals)
+
+    def find_microburst_peaks_grid(self, std_thresh=2, detect_channel=0, 
+                                return_intervals=False):
+        """
+        Find the microburst peaks in the detect_channel for every width 
+        pair in the significance_grid() stack. See 
+        SignalToBackground.find_microburst_peaks_grid.
+        """
+        return [self._multi_threshold_peaks(n_std[:, detect_channel], 
+                                            self.counts[:, detect_channel], 
+                                            [std_thresh], return_intervals)[std_thresh]
+                for n_std in self.n_std_grid]
+
+    def _significance(self, background_width_s, microburst_width_s):
         """
-        Calculate the running average of the counts array.
+        Calculate the significance of the counts above the background 
+        running average. The microburst width is not used.
         """
-        background_width_samples = int(self.background_width_s/self.cadence)
-        return counts.rolling(background_width_samples, center=True, axis=0).mean()
+        self.rolling_average = self._running_background(background_width_s)
+        n_std = np.subtract(self.counts, self.rolling_average)
+        n_std /= np.sqrt(self.rolling_average+1)
+        return n_std
+
+
+def _cumulative_sum(counts):
+    """
+    The cumulative sum of counts along the time axis (axis 0) with a 
+    leading row of zeros, so the sum of counts[i:j] is 
+    cumulative_counts[j] - cumulative_counts[i]. The sum is accumulated 
+    in float64 without a float64 copy of counts. NaN counts are summed as 
+    0 and counted separately, so the windows that contain a NaN can be 
+    set to NaN.
+
+    Returns
+    -------
+    tuple
+        The (cumulative_counts, cumulative_nans) arrays. cumulative_nans 
+        is None if counts has no NaNs.
+    """
+    cumulative_counts = np.zeros((counts.shape[0]+1,) + counts.shape[1:])
+    cumulative_nans = None
+
+    if np.issubdtype(counts.dtype, np.floating) and np.isnan(counts).any():
+        nans = np.isnan(counts)
+        np.cumsum(np.where(nans, 0, counts), axis=0, out=cumulative_counts[1:])
+        cumulative_nans = np.zeros(cumulative_counts.shape, dtype=np.int64)
+        np.cumsum(nans, axis=0, out=cumulative_nans[1:])
+    else:
+        np.cumsum(counts, axis=0, dtype=np.float64, out=cumulative_counts[1:])
+    return cumulative_counts, cumulative_nans
+
+def _centered_quantile(counts, window_samples, quantile, segment_id=None):
+    """
+    The centered running quantile (linearly interpolated, like 
+    np.quantile) over window_samples data points, with the same window 
+    alignment and NaN rules as _centered_mean. pandas keeps each window in 
+    a sorted skiplist, so every step costs O(log(window_samples)).
+    """
+    n = counts.shape[0]
+    if (window_samples < 1) or (window_samples > n):
+        return np.full(counts.shape, np.nan)
+
+    rolling = pd.DataFrame(counts.reshape(n, -1)).rolling(window_samples, center=True)
+    if quantile == 0.5:
+        running_quantile = rolling.median()
+    else:
+        running_quantile = rolling.quantile(quantile)
+    running_quantile = running_quantile.to_numpy().reshape(counts.shape)
+
+    if segment_id is not None:
+        start = window_samples//2
+        window_quantile = running_quantile[start:start + n - window_samples + 1]
+        window_quantile[segment_id[window_samples-1:] != segment_id[:n-window_samples+1]] = np.nan
+    return running_quantile
+
+def _segment_id(times, max_time_gap):
+    """
+    Number the continuous segments of the times array. A new segment 
+    starts after every time difference of at least max_time_gap seconds,
+    like the time_gap catalog flag.
+    """
+    dt = np.diff(np.asarray(times, dtype='datetime64[ns]')).astype(np.int64)/1E9
+    return np.concatenate(([0], np.cumsum(dt >= max_time_gap)))
+
+def _centered_mean(cumulative_sum, window_samples, segment_id=None):
+    """
+    The centered running mean over window_samples data points from the
+    _cumulative_sum output. It is the same as 
+    pd.DataFrame(counts).rolling(window_samples, center=True).mean(): 
+    the window around index i is counts[i-window_samples//2 : 
+    i-window_samples//2+window_samples], and the running mean is NaN 
+    where the window is not entirely inside the array or contains a NaN.
+    If the _segment_id array is given, the running mean is also NaN where
+    the window spans more than one segment.
+    """
+    cumulative_counts, cumulative_nans = cumulative_sum
+    n = cumulative_counts.shape[0]-1
+    running_mean = np.full(cumulative_counts[1:].shape, np.nan)
+    if (window_samples < 1) or (window_samples > n):
+        return running_mean
+
+    start = window_samples//2
+    end = start + n - window_samples + 1
+    # Compute in place to avoid the temporary nTime x nChannel arrays.
+    window_mean = running_mean[start:end]
+    np.subtract(cumulative_counts[window_samples:], cumulative_counts[:-window_samples], 
+                out=window_mean)
+    window_mean /= window_samples
+    if cumulative_nans is not None:
+        window_nans = cumulative_nans[window_samples:] - cumulative_nans[:-window_samples]
+        window_mean[window_nans > 0] = np.nan
+    if segment_id is not None:
+        # The segment ids increase so the first and last samples in the 
+        # window are in the same segment only if there are no gaps.
+        window_mean[segment_id[window_samples-1:] != segment_id[:n-window_samples+1]] = np.nan
+    return running_mean
 
 
 if __name__ == '__main__':
@@ -165,13 +483,11 @@ if __name__ == '__main__':
     # Load the HiRes data
     sc_id = 4
     hr_date = datetime(2019, 9, 27) 
-    search_str = f'FU{sc_id}*Hires*{hr_date.year}*{hr_date.month}*{hr_date.day}*L2*'
-    hr_paths = list(pathlib.Path(config.FB_DIR, ).rglob(search_str))
-    assert len(hr_paths) == 1, (f'A unique HiRes path not found.\n'
-                                f'hr_paths={hr_paths} search_str={search_str}')
-    hr_path = str(hr_paths[0])
-    hr = readJSONheadedASCII(str(hr_path))
-    hr['Time'] = pd.to_datetime(hr['Time'])
+    manifest = HiResManifest(
+        config.FB_DIR, pathlib.Path(config.PROJECT_DIR, 'data', 'hires_manifest.json')
+        )
+    hr_path = manifest.path(sc_id, hr_date)
+    hr = readJSONheadedASCII(hr_path, columns=['Col_counts'])
     cadence = float(hr.attrs['CADENCE'])
 
     # All of the code to detect microbursts is here.
@@ -186,8 +502,8 @@ if __name__ == '__main__':
 
     for i in range(6):
         ax[0].plot(hr['Time'], hr['Col_counts'][:, i], colors[i], label=f'Ch {i}')
-        ax[0].plot(hr['Time'], s.rolling_average[i], colors[i], ls='--')
-        ax[1].plot(hr['Time'], s.n_std[i], colors[i])
+        ax[0].plot(hr['Time'], s.rolling_average[:, i], colors[i], ls='--')
+        ax[1].plot(hr['Time'], s.n_std[:, i], colors[i])
 
     ax[0].scatter(hr['Time'][s.peak_idt], hr['Col_counts'][s.peak_idt, 0], 
                 c='r', marker='*', label='Microburst peaks')
@@ -1,5 +1,9 @@
+import concurrent.futures
+import hashlib
+import os
 import pathlib
 import subprocess
+import traceback
 
 import numpy as np
 import pandas as pd
@@ -7,12 +11,19 @@ import progressbar
 import matplotlib.pyplot as plt
 
 from microburst_detection.signal_to_background import signal_to_background
-from microburst_detection.misc.load_firebird import readJSONheadedASCII
+from microburst_detection.misc.load_firebird import readJSONheadedASCII, COMPACT_DTYPES
+from microburst_detection.misc.hires_cache import HiResCache
+from microburst_detection.misc.hires_manifest import HiResManifest
 from microburst_detection import config
 
+# Increment when the checkpoint contents change, so the old checkpoints
+# are not loaded.
+CHECKPOINT_VERSION = 5
+
 class SignalToBackgroundLoop:
     def __init__(self, sc_id, microburst_width_s, background_width_s, std_thresh, 
-        channel=0, catalog_columns=None):
+        channel=0, catalog_columns=None, cache_dir=None, max_time_gap=None,
+        background='mean', checkpoint_dir=None):
         """
         This program uses signal_to_background detection code to
         loop over all of the FIREBIRD data and detect all 
@@ -26,23 +37,48 @@ class SignalToBackgroundLoop:
             The microburst width to use for the running mean.
         background_width_s : float
             The baseline width in time to calculate the running mean
-        std_thresh : float
+        std_thresh : float or list
             The baseline standard deviation threshold above the baseline
-            that the data point must be to satisfy the microburst criteria
-        channel : int
+            that the data point must be to satisfy the microburst criteria.
+            If a list, a catalog is made for each threshold.
+        channel : int or list
             The FIREBIRD energy channel number to use for std_thresh 
-            critera. This is channel 0 by default.
+            critera. This is channel 0 by default. If a list, a catalog
+            is made for each channel from the same significance.
         catalog_columns : list
             What catalog to save in the catalog. If None, the keys are a 
             combination of HiRes keys, collimated count keys, 
             signal-to-backround keys, and a saturated key.
+        cache_dir : str, pathlib.Path, or False
+            The directory where the parsed HiRes files are cached. If None,
+            the cache is in the <<project_folder>>/data/hires_cache/ folder.
+            If False, the HiRes files are not cached and only the needed 
+            columns are parsed, e.g. for a single pass over the mission.
+        max_time_gap : float
+            The time difference in seconds between consecutive time stamps
+            that splits the running averages. 5*cadence if None (see 
+            SignalToBackground).
+        background : str or float
+            The background estimator, either 'mean', 'median', or a 
+            percentile between 0 and 100 (see SignalToBackground).
+        checkpoint_dir : str or pathlib.Path
+            If not None, the catalog rows from each day are saved to this
+            directory as the loop runs. A rerun with the same parameters
+            loads the days that are done (if the HiRes file didn't change)
+            and only processes the rest, e.g. the new HiRes files.
         """
         self.sc_id = sc_id
         self.microburst_width_s = microburst_width_s
         self.background_width_s = background_width_s
         self.microburst_width_s = microburst_width_s
         self.std_thresh = std_thresh
+        self._multi_thresh = isinstance(std_thresh, (list, tuple, np.ndarray))
+        self.std_threshs = list(std_thresh) if self._multi_thresh else [std_thresh]
         self.channel = channel
+        self._multi_channel = isinstance(channel, (list, tuple, np.ndarray))
+        self.channels = list(channel) if self._multi_channel else [channel]
+        self.max_time_gap = max_time_gap
+        self.background = background
 
         if catalog_columns is None:
             self.hr_keys = ['Time', 'Lat', 'Lon', 'Alt', 
@@ -54,77 +90,285 @@ class SignalToBackgroundLoop:
         else:
             self.catalog_columns = catalog_columns
 
+        if cache_dir is None:
+            cache_dir = pathlib.Path(config.PROJECT_DIR, 'data', 'hires_cache')
+        self.hr_cache = None if cache_dir is False else HiResCache(cache_dir)
+
         # Find all of the HiRes files
-        search_str = f'FU{sc_id}_Hires_*L2.txt'
-        self.hr_paths = sorted(pathlib.Path(config.FB_DIR).rglob(search_str))
+        self.manifest = HiResManifest(
+            config.FB_DIR, pathlib.Path(config.PROJECT_DIR, 'data', 'hires_manifest.json')
+            )
+        self.hr_paths = self.manifest.paths(sc_id)
+
+        self.checkpoint_dir = None
+        if checkpoint_dir is not None:
+            # The checkpoints from different detector parameters are saved 
+            # in separate directories.
+            params = repr(self) + repr(self.catalog_columns) + f'v{CHECKPOINT_VERSION}'
+            params_hash = hashlib.sha1(params.encode()).hexdigest()[:10]
+            self.checkpoint_dir = pathlib.Path(checkpoint_dir, params_hash)
+            self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+            with open(pathlib.Path(self.checkpoint_dir, 'params.txt'), 'w') as f:
+                f.write(params)
         return
 
-    def loop(self, test_plots=False):
+    def loop(self, test_plots=False, n_workers=1):
         """
         Loop over all the HiRes data and run the signal_to_background
         microburst detector on every day. For the detected microbursts
         save a handful of columns specified by the save_keys kwarg to
         self.microburst_list.
+
+        If n_workers > 1, the days are processed in a pool of n_workers
+        processes and merged in date order, so the catalogs are identical
+        to the serial (n_workers=1) loop. The days that raised an error
+        are skipped, printed, and saved to the self.failed_days list of
+        (hr_path, traceback) tuples.
+
+        If channel and/or std_thresh are lists, every day is read and the
+        significance is calculated once, and one catalog per (channel, 
+        std_thresh) is saved to the self.microburst_lists dictionary. Then 
+        self.microburst_list is all of the catalogs concatenated, with 
+        extra detect_channel and/or std_thresh columns.
         """        
-        self.microburst_list = pd.DataFrame(columns=self.catalog_columns)
-
-        for hr_path in progressbar.progressbar(self.hr_paths, redirect_stdout=True):
-            self.hr = readJSONheadedASCII(hr_path)
-            self.cadence = self.hr.attrs['CADENCE']
-                
-            # All of the code to detect microbursts is here.
-            self.s = signal_to_background.FirebirdSignalToBackground(
-                self.hr['Col_counts'], self.cadence, 
-                self.background_width_s, 
-                self.microburst_width_s
+        # The daily catalog columns are accumulated in lists and 
+        # concatenated once after the loop.
+        self._daily_columns = {(channel, std_thresh):[]
+                                for channel in self.channels 
+                                for std_thresh in self.std_threshs}
+
+        self.failed_days = []
+        done_paths = {hr_path for hr_path in self.hr_paths 
+                    if (self.checkpoint_dir is not None) and 
+                    self._checkpoint_path(hr_path).exists()}
+        todo_paths = [hr_path for hr_path in self.hr_paths if hr_path not in done_paths]
+
+        if n_workers > 1:
+            if test_plots:
+                raise ValueError('test_plots are not supported with n_workers > 1.')
+            # The pool.map results are in the self.hr_paths (date) order.
+            pool = concurrent.futures.ProcessPoolExecutor(
+                n_workers, initializer=_init_worker, initargs=(self,)
                 )
-            self.s.significance()
-            try:
-                self.s.find_microburst_peaks(std_thresh=self.std_thresh, 
-                                        detect_channel=self.channel)
-            except ValueError as err:
-                if str(err) == 'No detections found':
-                    continue
-                else:
-                    raise
-            
-            dropout = self._dropout()
-            daily_microburst_list = pd.DataFrame(
-                data=np.nan*np.ones((len(self.s.peak_idt), len(self.catalog_columns)), dtype=object), 
-                columns=self.catalog_columns
+            with pool:
+                results = pool.map(_process_day_worker, todo_paths)
+                self._merge_days(self._checkpoint_days(results, done_paths))
+        else:
+            results = (self._try_process_day(hr_path, test_plots=test_plots) 
+                        for hr_path in todo_paths)
+            self._merge_days(self._checkpoint_days(results, done_paths))
+
+        for hr_path, error in self.failed_days:
+            print(f'Failed to process {hr_path}:\n{error}')
+
+        self.microburst_lists = {key:self._concatenate_days(daily_columns)
+                                for key, daily_columns in self._daily_columns.items()}
+        del(self._daily_columns)
+
+        if self._multi_channel or self._multi_thresh:
+            self.microburst_list = pd.concat(
+                [self._label_catalog(microburst_list, channel, std_thresh) 
+                for (channel, std_thresh), microburst_list in self.microburst_lists.items()],
+                ignore_index=True
                 )
-            daily_microburst_list.loc[:, self.hr_keys] = np.array(
-                [self.hr[col][self.s.peak_idt] for col in self.hr_keys],
-                dtype=object
-                ).T
-            daily_microburst_list.loc[:, self.count_keys] = self.hr['Col_counts'][self.s.peak_idt, :]/self.cadence
-            daily_microburst_list.loc[:, self.sig_keys] = self.s.n_std.loc[self.s.peak_idt, :].to_numpy()
-            daily_microburst_list.loc[:, 'time_gap'] = self._time_gaps()
-            daily_microburst_list.loc[:, 'saturated'] = dropout[self.s.peak_idt]
-            daily_microburst_list.loc[:, 'n_zeros'] = self._number_of_nearby_zeros()
-                                            
-            self.microburst_list = pd.concat((self.microburst_list, daily_microburst_list))
+        else:
+            self.microburst_list = self.microburst_lists[(self.channel, self.std_thresh)]
+        return self.microburst_list
 
-            if test_plots:
-                fig, ax = plt.subplots(2, sharex=True)
-                ax[0].plot(self.hr['Time'], self.hr['Col_counts'][:, self.channel], c='k')
-                ax[0].scatter(
-                    self.hr['Time'][self.s.peak_idt], 
-                    self.hr['Col_counts'][self.s.peak_idt, self.channel],
-                    marker='X', s=100, c='r', alpha=dropout[self.s.peak_idt]
-                    )
-                ax[0].scatter(
-                    self.hr['Time'][self.s.peak_idt], 
-                    self.hr['Col_counts'][self.s.peak_idt, self.channel],
-                    marker='*', s=200, c='r', alpha=1-dropout[self.s.peak_idt]
-                    )
-                ax[1].plot(self.hr['Time'], dropout)
-                # ax[1].plot(self.hr['Time'], dropout)
-                plt.show()
+    def _merge_days(self, results):
+        """
+        Append the (hr_path, daily_microburst_lists, error) day results
+        to self.microburst_lists in order.
+        """
+        for hr_path, daily_microburst_lists, error in progressbar.progressbar(
+                results, max_value=len(self.hr_paths), redirect_stdout=True):
+            if error is not None:
+                self.failed_days.append((hr_path, error))
+                continue
+            for key, daily_microburst_list in daily_microburst_lists.items():
+                self._daily_columns[key].append(daily_microburst_list)
+        return
+
+    def _concatenate_days(self, daily_columns):
+        """
+        Concatenate the daily catalog columns into a catalog DataFrame.
+        """
+        if len(daily_columns) == 0:
+            return pd.DataFrame(columns=self.catalog_columns)
+        return pd.DataFrame({
+            column:np.concatenate([columns[column] for columns in daily_columns])
+            for column in self.catalog_columns
+            })
+
+    def _checkpoint_days(self, results, done_paths):
+        """
+        Merge the day results of the processed days with the checkpoints 
+        of the done_paths days in the self.hr_paths order, and save the 
+        checkpoints of the processed days.
+        """
+        for hr_path in self.hr_paths:
+            if hr_path in done_paths:
+                yield hr_path, pd.read_pickle(self._checkpoint_path(hr_path)), None
+                continue
+            result = next(results)
+            if (self.checkpoint_dir is not None) and (result[2] is None):
+                self._save_checkpoint(hr_path, result[1])
+            yield result
+        return
+
+    def _checkpoint_path(self, hr_path):
+        """
+        The checkpoint path of a HiRes day. The name includes a hash of the
+        HiRes file's absolute path, so same-named files in different 
+        directories don't collide, and a hash of its size and modification 
+        time, so a changed file is processed again.
+        """
+        hr_path = pathlib.Path(hr_path).resolve()
+        stat = os.stat(hr_path)
+        version = f'{stat.st_size}:{stat.st_mtime_ns}'
+        version_hash = hashlib.sha1(version.encode()).hexdigest()[:10]
+        return pathlib.Path(self.checkpoint_dir, 
+                            f'{self._checkpoint_prefix(hr_path)}_{version_hash}.pkl')
+
+    def _checkpoint_prefix(self, hr_path):
+        """
+        The checkpoint name prefix that is shared by all versions of a 
+        HiRes file: its name and a hash of its absolute path.
+        """
+        hr_path = pathlib.Path(hr_path).resolve()
+        path_hash = hashlib.sha1(str(hr_path).encode()).hexdigest()[:10]
+        return f'{hr_path.stem}_{path_hash}'
+
+    def _save_checkpoint(self, hr_path, daily_microburst_lists):
+        """
+        Save the daily microburst lists of a HiRes day, and delete the 
+        checkpoints of older versions of the HiRes file.
+        """
+        checkpoint_path = self._checkpoint_path(hr_path)
+        for old_path in self.checkpoint_dir.glob(f'{self._checkpoint_prefix(hr_path)}_*.pkl'):
+            old_path.unlink(missing_ok=True)
+
+        # Write to a temporary file first so a partially written checkpoint 
+        # is never read.
+        tmp_path = checkpoint_path.with_suffix(f'.{os.getpid()}.tmp')
+        pd.to_pickle(daily_microburst_lists, tmp_path)
+        os.replace(tmp_path, checkpoint_path)
+        return
+
+    def _try_process_day(self, hr_path, test_plots=False):
+        """
+        Run _process_day and catch the errors so one bad day does not stop
+        the loop.
+
+        Returns
+        -------
+        tuple
+            The (hr_path, daily_microburst_lists, error) tuple. The error is
+            the traceback string, or None if the day was processed.
+        """
+        try:
+            return hr_path, self._process_day(hr_path, test_plots=test_plots), None
+        except Exception:
+            return hr_path, None, traceback.format_exc()
+
+    def _label_catalog(self, microburst_list, channel, std_thresh):
+        """
+        Add the detect_channel and std_thresh columns to a catalog if 
+        there are multiple channels and thresholds, respectively.
+        """
+        if self._multi_channel:
+            microburst_list = microburst_list.assign(detect_channel=channel)
+        if self._multi_thresh:
+            microburst_list = microburst_list.assign(std_thresh=std_thresh)
+        return microburst_list
+
+    def _process_day(self, hr_path, test_plots=False):
+        """
+        Run the microburst detector on one HiRes day for all of the 
+        channels and thresholds. 
+
+        Returns
+        -------
+        dict
+            The (channel, std_thresh) -> daily microburst list dictionary.
+            The channels and thresholds without detections are not 
+            included.
+        """
+        # The other columns are parsed only if there are detections. The
+        # ephemeris stays float64 so it is saved to the catalog unchanged.
+        self.hr = readJSONheadedASCII(
+            hr_path, columns=['Col_counts'],
+            dtypes={'Col_counts':COMPACT_DTYPES['Col_counts']},
+            cache=self.hr_cache
+            )
+        self.cadence = self.hr.attrs['CADENCE']
             
-        self.microburst_list = self.microburst_list.reset_index()
-        del(self.microburst_list['index'])  # Duplicate
-        return self.microburst_list
+        # All of the code to detect microbursts is here.
+        # The running averages are NaN where the windows span a time gap.
+        self.s = signal_to_background.FirebirdSignalToBackground(
+            self.hr['Col_counts'], self.cadence, 
+            self.background_width_s, 
+            self.microburst_width_s,
+            times=self.hr['Time'],
+            max_time_gap=self.max_time_gap,
+            background=self.background
+            )
+        self.s.significance()
+        peaks = {}
+        for channel in self.channels:
+            channel_peaks = self.s.find_microburst_peaks_multi(self.std_threshs, 
+                                                            detect_channel=channel)
+            peaks.update({(channel, std_thresh):peak_idt 
+                        for std_thresh, peak_idt in channel_peaks.items() 
+                        if len(peak_idt) > 0})
+        if len(peaks) == 0:
+            return {}
+        
+        dropouts = {channel:self._dropout(channel) for channel, _ in peaks}
+        self.hr.load(self.hr_keys)
+        daily_microburst_lists = {
+            (channel, std_thresh):self._daily_microburst_list(peak_idt, dropouts[channel])
+            for (channel, std_thresh), peak_idt in peaks.items()
+            }
+
+        if test_plots:
+            (channel, _), peak_idt = next(iter(peaks.items()))
+            dropout = dropouts[channel]
+            fig, ax = plt.subplots(2, sharex=True)
+            ax[0].plot(self.hr['Time'], self.hr['Col_counts'][:, channel], c='k')
+            ax[0].scatter(
+                self.hr['Time'][peak_idt], 
+                self.hr['Col_counts'][peak_idt, channel],
+                marker='X', s=100, c='r', alpha=dropout[peak_idt]
+                )
+            ax[0].scatter(
+                self.hr['Time'][peak_idt], 
+                self.hr['Col_counts'][peak_idt, channel],
+                marker='*', s=200, c='r', alpha=1-dropout[peak_idt]
+                )
+            ax[1].plot(self.hr['Time'], dropout)
+            # ax[1].plot(self.hr['Time'], dropout)
+            plt.show()
+        return daily_microburst_lists
+
+    def _daily_microburst_list(self, peak_idt, dropout):
+        """
+        Make the microburst catalog columns for the peak_idt detections in
+        the current HiRes day.
+
+        Returns
+        -------
+        dict
+            The catalog column -> typed array dictionary.
+        """
+        columns = {col:np.asarray(self.hr[col][peak_idt]) for col in self.hr_keys}
+        counts_s = self.hr['Col_counts'][peak_idt, :]/self.cadence
+        columns.update({col:counts_s[:, i] for i, col in enumerate(self.count_keys)})
+        columns.update({col:self.s.n_std[peak_idt, i] for i, col in enumerate(self.sig_keys)})
+        columns['time_gap'] = self._time_gaps(peak_idt)
+        columns['saturated'] = dropout[peak_idt]
+        columns['n_zeros'] = self._number_of_nearby_zeros(peak_idt)
+        return {col:columns[col] for col in self.catalog_columns}
 
     def save_microbursts(self, save_name=None):
         """
@@ -148,8 +392,22 @@ class SignalToBackgroundLoop:
         else:
             save_path = pathlib.Path(save_dir, save_name)
 
-        self.microburst_list.to_csv(save_path, index=False)
-        self._save_log(save_path)
+        if self._multi_channel or self._multi_thresh:
+            # One catalog per channel and threshold.
+            for (channel, std_thresh), microburst_list in self.microburst_lists.items():
+                suffix = ''
+                if self._multi_channel:
+                    suffix += f'_channel_{channel}'
+                if self._multi_thresh:
+                    suffix += f'_std_thresh_{std_thresh}'
+                catalog_save_path = save_path.with_name(
+                    f'{save_path.stem}{suffix}{save_path.suffix}'
+                    )
+                microburst_list.to_csv(catalog_save_path, index=False)
+                self._save_log(catalog_save_path)
+        else:
+            self.microburst_list.to_csv(save_path, index=False)
+            self._save_log(save_path)
         return
 
     def _save_log(self, save_path):
@@ -179,98 +437,154 @@ class SignalToBackgroundLoop:
                 mode='a', header=header, index=False)
         return
 
-    def _time_gaps(self, width_s=5, max_time_gap=None):
+    def _time_gaps(self, peak_idts, width_s=5, max_time_gap=None):
         """
         For each microburst, check if the time stamps within 
         int(width_s/self.cadence) data points have a time 
         difference less than time_gap. 
 
+        peak_idts: np.array
+            The microburst peak indices.
         width_s: int
             Used to identify the time window (in data points) 
             around each microburst to test for time gaps.
         max_time_gap: float
             The maximum allowable time difference between time 
             stamps within the window_s okay keep the microburst. 
-            10*self.cadence if None. 
+            5*self.cadence if None. 
+
+        The running averages are already split at the time gaps, but this
+        flag is kept since it marks the microbursts within width_s of a 
+        gap, which is a much wider window than the running averages, and
+        the catalog users filter on it.
         """
         width_dp = int(width_s/(self.cadence*2))
         if max_time_gap is None:
             max_time_gap = 5*self.cadence
 
-        near_gap = np.ones_like(self.s.peak_idt)  # Default to all near a time gap.
-        for i, peak_idt in enumerate(self.s.peak_idt):
-            # A time gap if the detection was made in the very begining or end of the day.
-            if (peak_idt-width_dp < 0) or (peak_idt+width_dp >= len(self.hr['Time'])):
-                continue
-            filtered_times = self.hr['Time'][peak_idt-width_dp:peak_idt+width_dp]
-            dt = np.array([(tf-ti).total_seconds() for tf, ti in zip(filtered_times[1:], filtered_times[:-1])])
-            if np.max(dt) < max_time_gap:
-                near_gap[i] = 0
+        # The number of time gaps before each time stamp, so the number of
+        # gaps between time stamps i and j is n_gaps[j] - n_gaps[i].
+        dt = np.diff(self.hr['Time'].asi8)/1E9
+        n_gaps = np.concatenate(([0], np.cumsum(dt >= max_time_gap)))
+
+        # A time gap if the detection was made in the very begining or end of the day.
+        near_gap = np.ones_like(peak_idts)  # Default to all near a time gap.
+        inside = (peak_idts-width_dp >= 0) & (peak_idts+width_dp < len(self.hr['Time']))
+        window_gaps = n_gaps[peak_idts[inside]+width_dp-1] - n_gaps[peak_idts[inside]-width_dp]
+        near_gap[inside] = (window_gaps > 0)
         return near_gap
 
-    def _number_of_nearby_zeros(self, width_s=5):
+    def _number_of_nearby_zeros(self, peak_idts, width_s=5):
         """
         Look for, and count how many zero counts were near each microburst.
 
+        peak_idts: np.array
+            The microburst peak indices.
         width_s: int
             Used to identify the time window (in data points) 
             around each microburst to look for zeros.
         """
         # width_dp = int(width_s/(self.cadence*2))
-        
-        n_zeros = np.zeros_like(self.s.peak_idt)  # Default to all near a time gap.
-        for i, peak_idt in enumerate(self.s.peak_idt):
-            idt = np.where(
-                (self.hr['Time'] > self.hr['Time'][peak_idt]-pd.Timedelta(seconds=width_s/2)) & 
-                (self.hr['Time'] < self.hr['Time'][peak_idt]+pd.Timedelta(seconds=width_s/2))
-                )[0]                
-            n_zeros[i] = sum(self.hr['Col_counts'][idt, 0]==0)
-        return n_zeros
 
+        # The number of zeros before each sample, so the number of zeros 
+        # in samples i to j-1 is n_zeros_before[j] - n_zeros_before[i].
+        n_zeros_before = np.concatenate(
+            ([0], np.cumsum(self.hr['Col_counts'][:, 0] == 0))
+            )
+        # The windows are the time stamps strictly inside 
+        # peak time +/- width_s/2. This assumes that the time stamps are 
+        # sorted.
+        times = self.hr['Time'].asi8
+        half_width = pd.Timedelta(seconds=width_s/2).value
+        peak_times = times[peak_idts]
+        start = np.searchsorted(times, peak_times-half_width, side='right')
+        end = np.searchsorted(times, peak_times+half_width, side='left')
+        n_zeros = n_zeros_before[end] - n_zeros_before[start]
+        return n_zeros.astype(peak_idts.dtype)
 
-    def _dropout(self, derivative_thresh=300, quarantine_dp=20):
+    def _dropout(self, channel, derivative_thresh=300, quarantine_dp=20):
         """
         Identify dropouts in the FIREBIRD data using the derivative approach.
 
+        channel: int
+            The FIREBIRD channel to look for dropouts in.
         derivative_thresh: float
             How much the counts need to change by (increase or decrease) over one data
             point.
         quarantine_dp: int
             How many data points around the dropout to flag as affected by the dropout.
         """
-        counts = self.hr['Col_counts'][:, self.channel]
+        counts = self.hr['Col_counts'][:, channel]
         # Technically there is a division here, but we can ignore it since were working in count space.
         dc_dt = counts[1:] - counts[:-1]
         dropouts = np.zeros_like(counts, dtype=int)
 
-        for i, (dc_dt_i, dc_dt_f) in enumerate(zip(dc_dt[:-1], dc_dt[1:])):
-            # Check for a large drop, immediately followed by a large increase 
-            # by greather than derivative_thresh counts (per bin). 
-            if (dc_dt_i < -derivative_thresh) and (dc_dt_f > derivative_thresh):
-                start_index = max(0, i-quarantine_dp)
-                end_index = min(i+quarantine_dp, len(dropouts)-1)
-                # Mark all data points within +/- quarantine_dp as a dropout.
-                dropouts[start_index:end_index] = 1
+        # Check for a large drop, immediately followed by a large increase 
+        # by greather than derivative_thresh counts (per bin). 
+        dropout_idt = np.where(
+            (dc_dt[:-1] < -derivative_thresh) & (dc_dt[1:] > derivative_thresh)
+            )[0]
+        # Mark all data points within +/- quarantine_dp as a dropout, using
+        # +1 at the start and -1 at the end of each quarantine interval.
+        start_index = np.maximum(0, dropout_idt-quarantine_dp)
+        end_index = np.minimum(dropout_idt+quarantine_dp, len(dropouts)-1)
+        edges = np.zeros(len(dropouts)+1, dtype=int)
+        np.add.at(edges, start_index, 1)
+        np.add.at(edges, end_index, -1)
+        dropouts[np.cumsum(edges[:-1]) > 0] = 1
         return dropouts
 
+    def __getstate__(self):
+        """
+        Don't send the current day's data and the catalogs to the worker
+        processes.
+        """
+        state = self.__dict__.copy()
+        for key in ['hr', 's', 'microburst_list', 'microburst_lists', 'failed_days',
+                    '_daily_columns']:
+            state.pop(key, None)
+        return state
+
     def __repr__(self):
         params = (
                 f'sc_id={self.sc_id}, '
                 f'microburst_width_s={self.microburst_width_s}, '
                 f'background_width_s={self.background_width_s}, '
                 f'std_thresh={self.std_thresh},'
-                f'channel={self.channel}'
+                f'channel={self.channel}, '
+                f'max_time_gap={self.max_time_gap}, '
+                f'background={self.background}'
                 )
         return f'{self.__class__.__qualname__}(' + params + ')'
    
 
+# The SignalToBackgroundLoop instance in a worker process.
+_worker_loop = None
+
+def _init_worker(loop):
+    """
+    Set the SignalToBackgroundLoop instance of a worker process.
+    """
+    global _worker_loop
+    _worker_loop = loop
+    return
+
+def _process_day_worker(hr_path):
+    """
+    Process one HiRes day in a worker process. See 
+    SignalToBackgroundLoop._try_process_day.
+    """
+    return _worker_loop._try_process_day(hr_path)
+
+
 if __name__ == '__main__':
     microburst_width_s = 0.1
     background_width_s = 0.5
     std_thresh = 10
 
     for sc_id in [3, 4]:
-        for channel in range(6):
-            s = SignalToBackgroundLoop(sc_id, microburst_width_s, background_width_s, std_thresh, channel=channel)
-            s.loop()
-            s.save_microbursts()
+        # One pass over the HiRes data makes the catalogs for all 6 channels.
+        s = SignalToBackgroundLoop(sc_id, microburst_width_s, background_width_s, 
+                                std_thresh, channel=list(range(6)))
+        s.loop()
+        s.save_microbursts()
@@ -0,0 +1,238 @@
+import numpy as np
+
+from microburst_detection.signal_to_background.signal_to_background import SignalToBackground
+
+class StreamingSignalToBackground(SignalToBackground):
+    def __init__(self, cadence, background_width_s, microburst_width_s,
+                std_thresh=2, detect_channel=0):
+        """
+        A streaming version of SignalToBackground for incoming telemetry,
+        or archives that don't fit in memory. The counts are pushed in
+        blocks, and every push() returns the significance values and
+        microburst peaks that are final, i.e. the samples whose centered
+        windows are complete and the intervals that ended. The latency is
+        half of the longest window.
+
+        The running sums are continued from block to block, so the
+        significance and peaks are identical to the SignalToBackground
+        batch output on the concatenated counts. The one exception is a
+        stream with a single sample above std_thresh, which is reported
+        here while find_microburst_peaks raises a ValueError. Only the
+        samples in the longest window, and the current block, are kept in
+        memory.
+
+        Parameters
+        ----------
+        cadence : float
+            Instrument cadence (seconds)
+        background_width_s : float
+            The baseline width in seconds to calculate the running mean,
+            i.e. the a500 parameter in the O'Brien paper.
+        microburst_width_s : float
+            The duration to seconds integrate the signal, i.e. the n100
+            parameter in the O'Brien 2003 paper.
+        std_thresh : float
+            The baseline standard deviation threshold above the baseline
+            that the data point must be to satisfy the microburst criteria
+        detect_channel : int
+            The channel used to find the microbursts if the counts are 2d
+            (nTime x nChannel).
+
+        Example
+        -------
+        s = StreamingSignalToBackground(cadence, 0.5, 0.1, std_thresh=10)
+        for counts in blocks:
+            n_std, peak_idt = s.push(counts)
+        n_std, peak_idt = s.flush()
+        """
+        super().__init__(np.array([]), cadence, background_width_s, microburst_width_s)
+        self.std_thresh = std_thresh
+        self.detect_channel = detect_channel
+        self.window_samples = [int(microburst_width_s/cadence),
+                                int(background_width_s/cadence)]
+        # The number of samples before and after the center of the windows.
+        self._lookbehind = max(max(n//2, 0) for n in self.window_samples)
+        self._lookahead = max(max(n-1-n//2, 0) for n in self.window_samples)
+        self.reset()
+        return
+
+    def reset(self):
+        """
+        Clear the stream state to start a new stream.
+        """
+        self.n_samples = 0
+        self.n_emitted = 0
+        self._counts_buffer = None
+        self._cumulative_counts = None
+        self._cumulative_nans = None
+        # The absolute index of the first row in the cumulative buffers.
+        self._buffer_start = 0
+        # The (peak_idt, peak_counts) of the interval that has not ended yet.
+        self._open_interval = None
+        return
+
+    def push(self, counts):
+        """
+        Add a block of counts to the stream.
+
+        Parameters
+        ----------
+        counts : array
+            The next counts, either 1d (nTime) or 2d (nTime x nChannel).
+
+        Returns
+        -------
+        n_std : np.array
+            The significance of the samples that are now final, starting
+            at sample self.n_emitted (before this call).
+        peak_idt : np.array
+            The (stream) indices of the microburst peaks whose intervals
+            ended.
+        """
+        counts = np.asarray(counts)
+        if self._counts_buffer is None:
+            self._init_buffers(counts)
+
+        # Continue the cumulative sum from its last value so the sums are
+        # identical to the batch cumulative sum.
+        if self._cumulative_nans is not None:
+            nans = np.isnan(counts)
+            self._cumulative_nans = np.concatenate((self._cumulative_nans,
+                np.cumsum(np.concatenate((self._cumulative_nans[-1:], nans)), axis=0)[1:]))
+            block = np.where(nans, 0, counts)
+        else:
+            block = counts
+        self._cumulative_counts = np.concatenate((self._cumulative_counts,
+            np.cumsum(np.concatenate((self._cumulative_counts[-1:], block)), axis=0,
+                    dtype=np.float64)[1:]))
+        self._counts_buffer = np.concatenate((self._counts_buffer, counts))
+        self.n_samples += counts.shape[0]
+
+        return self._emit(max(self.n_samples-self._lookahead, self.n_emitted))
+
+    def flush(self):
+        """
+        End the stream. The significance of the last samples is NaN since
+        their windows are incomplete, like in the batch output.
+
+        Returns
+        -------
+        tuple
+            The remaining (n_std, peak_idt), see push().
+        """
+        if self._counts_buffer is None:
+            return np.array([]), np.array([], dtype=int)
+        return self._emit(self.n_samples, final=True)
+
+    def _init_buffers(self, counts):
+        """
+        Make the empty buffers for the counts shape and dtype.
+        """
+        channel_shape = counts.shape[1:]
+        self._counts_buffer = np.zeros((0,) + channel_shape, dtype=counts.dtype)
+        self._cumulative_counts = np.zeros((1,) + channel_shape)
+        if np.issubdtype(counts.dtype, np.floating):
+            self._cumulative_nans = np.zeros((1,) + channel_shape, dtype=np.int64)
+        return
+
+    def _emit(self, frontier, final=False):
+        """
+        Calculate the significance for samples self.n_emitted to frontier,
+        and find the microburst intervals that ended.
+        """
+        idt = np.arange(self.n_emitted, frontier)
+        microburst_rolling_average, background_rolling_average = [
+            self._window_mean(idt, window_samples)
+            for window_samples in self.window_samples
+            ]
+        n_std = microburst_rolling_average-background_rolling_average
+        n_std /= np.sqrt(background_rolling_average+1)
+
+        counts = self._counts_buffer[:len(idt)]
+        if counts.ndim > 1:
+            peak_idt = self._stream_peaks(n_std[:, self.detect_channel],
+                                        counts[:, self.detect_channel], final)
+        else:
+            peak_idt = self._stream_peaks(n_std, counts, final)
+
+        # Drop the samples that are no longer needed.
+        self.n_emitted = frontier
+        self._counts_buffer = self._counts_buffer[len(idt):]
+        drop_rows = max(self.n_emitted-self._lookbehind-self._buffer_start, 0)
+        self._cumulative_counts = self._cumulative_counts[drop_rows:]
+        if self._cumulative_nans is not None:
+            self._cumulative_nans = self._cumulative_nans[drop_rows:]
+        self._buffer_start += drop_rows
+        return n_std, peak_idt
+
+    def _window_mean(self, idt, window_samples):
+        """
+        The centered running mean at the idt samples. The mean is NaN
+        where the window is not entirely inside the stream (so far) or
+        contains a NaN, like _centered_mean.
+        """
+        running_mean = np.full((len(idt),) + self._counts_buffer.shape[1:], np.nan)
+        if window_samples < 1:
+            return running_mean
+
+        window_start = idt - window_samples//2
+        valid = (window_start >= 0) & (window_start + window_samples <= self.n_samples)
+        start = window_start[valid] - self._buffer_start
+        end = start + window_samples
+        window_mean = np.subtract(self._cumulative_counts[end], self._cumulative_counts[start])
+        window_mean /= window_samples
+        if self._cumulative_nans is not None:
+            window_nans = self._cumulative_nans[end] - self._cumulative_nans[start]
+            window_mean[window_nans > 0] = np.nan
+        running_mean[valid] = window_mean
+        return running_mean
+
+    def _stream_peaks(self, n_std, counts, final):
+        """
+        Find the peaks of the intervals that ended in this block. The
+        interval that reaches the end of the block stays open until the
+        next block, unless final=True.
+        """
+        if (len(n_std) == 0) and (not final):
+            return np.array([], dtype=int)
+
+        criteria_idt = np.where(n_std >= self.std_thresh)[0]
+        if len(criteria_idt) > 0:
+            peak_idt, interval_start, interval_end, _ = self._interval_peaks(
+                counts, criteria_idt)
+            peaks = list(zip(peak_idt + self.n_emitted, counts[peak_idt]))
+        else:
+            interval_start = interval_end = peaks = []
+
+        if self._open_interval is not None:
+            if (len(peaks) > 0) and (interval_start[0] == 0):
+                # The open interval continues into this block.
+                peaks[0] = self._max_peak(self._open_interval, peaks[0])
+            else:
+                peaks.insert(0, self._open_interval)
+            self._open_interval = None
+
+        if (not final) and (len(criteria_idt) > 0) and (interval_end[-1] == len(n_std)-1):
+            self._open_interval = peaks.pop()
+        return np.array([peak[0] for peak in peaks], dtype=int)
+
+    def _max_peak(self, first_peak, second_peak):
+        """
+        The (peak_idt, peak_counts) peak with the larger counts. Ties go
+        to the first peak and NaN counts are the maximum, like np.argmax.
+        """
+        if np.isnan(first_peak[1]):
+            return first_peak
+        if np.isnan(second_peak[1]) or (second_peak[1] > first_peak[1]):
+            return second_peak
+        return first_peak
+
+    def __repr__(self):
+        params = (
+                f'cadence={self.cadence}, '
+                f'background_width_s={self.background_width_s}, '
+                f'microburst_width_s={self.microburst_width_s}, '
+                f'std_thresh={self.std_thresh}, '
+                f'detect_channel={self.detect_channel}'
+                )
+        return f'{self.__class__.__qualname__}(' + params + ')'
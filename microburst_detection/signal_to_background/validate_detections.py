@@ -10,22 +10,25 @@ import matplotlib.ticker
 import matplotlib.dates
 
 from signal_to_background import config
-from microburst_detection.misc.load_firebird import readJSONheadedASCII
+from microburst_detection.misc.load_firebird import readJSONheadedASCII, COMPACT_DTYPES
+from microburst_detection.misc.hires_cache import HiResCache
+from microburst_detection.misc.hires_manifest import HiResManifest
 
 
 plot_window_s = 2
+hr_cache = HiResCache(pathlib.Path(config.PROJECT_DIR, 'data', 'hires_cache'))
+manifest = HiResManifest(
+    config.FB_DIR, pathlib.Path(config.PROJECT_DIR, 'data', 'hires_manifest.json')
+    )
 
 def load_hr(date):
     """
     Load the HiRes data.
     """
-    search_str = f'FU{sc_id}_Hires_{date.strftime("%Y-%m-%d")}_L2.txt'
-    hr_paths = sorted(pathlib.Path(config.FB_DIR).rglob(search_str))
-    assert len(hr_paths) == 1, (
-        f'{len(hr_paths)} HiRes paths found in {pathlib.Path(config.FB_DIR)} '
-        f'that match {search_str}.'
+    hr_path = manifest.path(sc_id, date)
+    hr = readJSONheadedASCII(
+        hr_path, columns=['Col_counts'], dtypes=COMPACT_DTYPES, cache=hr_cache
         )
-    hr = readJSONheadedASCII(hr_paths[0])
     return hr
 
 for sc_id in [3,4]:
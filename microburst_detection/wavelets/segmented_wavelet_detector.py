@@ -0,0 +1,202 @@
+import concurrent.futures
+import math
+
+import numpy as np
+
+from microburst_detection.wavelets.wavelet_analysis import WaveletDetector
+from microburst_detection.wavelets.wavelet_functions import wave_bases
+
+
+class SegmentedWaveletDetector:
+    def __init__(self, data, time, cadence, segment_s=600, lower_period=None,
+                upper_period=0.5, **kwargs):
+        """
+        Run the WaveletDetector on a long time series, e.g. a full day of
+        HiRes data, in fixed-length segments. The memory of the wavelet
+        transforms is bounded by the segment length instead of the time
+        series length.
+
+        Every segment is extended on both sides by an overlap so that the
+        detections in its core are not affected by the segment edges. The
+        overlap is the cone of influence (coi) of the longest filtered
+        period, plus the TIME_THRESH data gap window of
+        WaveletDetector.TestForMicrobursts. The filtered data and the
+        microburst indices are only kept from the segment cores, and the
+        peaks are found on the stitched indices, so the microbursts at the
+        segment boundaries are not duplicated.
+
+        The mean, standard deviation, and lag-1 autocorrelation that
+        normalize the data and set the significance levels are calculated
+        once over the whole time series and used for every segment, so the
+        results do not depend on how the data is split into segments.
+
+        Parameters
+        ----------
+        data : array
+            The 1d counts.
+        time : array
+            The data time stamps, either datetimes or floats in seconds.
+        cadence : float
+            Instrument cadence (seconds)
+        segment_s : float
+            The segment core length in seconds.
+        lower_period : float
+            The lower period of the waveletFilter band. If None, the
+            smallest scale, s0.
+        upper_period : float
+            The upper period of the waveletFilter band.
+        **kwargs
+            The WaveletDetector kwargs, e.g. mother, j1, dj, s0, and siglvl.
+            The mean, std, and lag1 kwargs override the whole time series
+            values.
+
+        Example
+        -------
+        s = SegmentedWaveletDetector(counts, times, cadence, siglvl=0.95)
+        peaks = s.detect(n_workers=4, COUNT_THRESH=0.1)
+        """
+        self.data = np.asarray(data)
+        self.time = time
+        self.cadence = cadence
+        self.segment_s = segment_s
+        self.upper_period = upper_period
+        self.detector_kwargs = kwargs
+        self.detector_kwargs.pop('run_scipt', None)
+        # Normalize every segment like the whole time series.
+        if self.detector_kwargs.get('mean', None) is None:
+            self.detector_kwargs['mean'] = np.mean(self.data)
+        if self.detector_kwargs.get('std', None) is None:
+            self.detector_kwargs['std'] = np.std(self.data, ddof=1)
+        if self.detector_kwargs.get('lag1', None) is None:
+            self.detector_kwargs['lag1'] = WaveletDetector.lagNAutoCorr(self.data, 1)
+        self.lower_period = lower_period
+        if self.lower_period is None:
+            self.lower_period = self.detector_kwargs.get('s0', 2*cadence)
+        self.segment_samples = max(int(segment_s/cadence), 1)
+        return
+
+    def detect(self, n_workers=1, **kwargs):
+        """
+        Filter every segment with WaveletDetector.filteredInvWaveletTransform,
+        test for microbursts, and find the microburst peaks.
+
+        Parameters
+        ----------
+        n_workers : int
+            If n_workers > 1, the segments are processed in a pool of
+            n_workers processes. The results are identical to the serial
+            (n_workers=1) run.
+        **kwargs
+            The WaveletDetector.TestForMicrobursts kwargs, COUNT_THRESH and
+            TIME_THRESH.
+
+        Returns
+        -------
+        np.array
+            The microburst peak indices, also saved to self.peaks. The
+            filtered data and the indices that satisfied the microburst
+            criteria are saved to self.dataFlt and self.indicies, and the
+            microburst interval [start, end) indices to self.startInd and
+            self.endInd.
+        """
+        self.overlap = self._overlap_samples(kwargs.get('TIME_THRESH', 1.00))
+        segments = self._segments()
+        args = (
+            (self.data[start:end], self.time[start:end], self.cadence,
+            self.lower_period, self.upper_period, self.detector_kwargs, kwargs)
+            for start, end, _, _ in segments
+            )
+
+        if n_workers > 1:
+            # The pool.map results are in the segment order.
+            with concurrent.futures.ProcessPoolExecutor(n_workers) as pool:
+                results = pool.map(_detect_segment, *zip(*args))
+                self._stitch(segments, results)
+        else:
+            self._stitch(segments, (_detect_segment(*segment_args) for segment_args in args))
+
+        self._find_peaks()
+        return self.peaks
+
+    def _overlap_samples(self, time_thresh):
+        """
+        The number of samples that the segments are extended by on each
+        side. The cone of influence at distance t from an edge is
+        coi_factor*t in period units (see wavelet_functions.wavelet), so the
+        longest filtered period is free of edge effects after
+        fourier_factor*max_scale/coi_factor seconds.
+        """
+        probe = WaveletDetector(self.data[:self.segment_samples],
+                                self.time[:self.segment_samples],
+                                self.cadence, **self.detector_kwargs)
+        band = probe.scaleBand(self.lower_period, self.upper_period)
+        coi_overlap = 0
+        if band.stop > band.start:
+            max_scale = probe.s0*2**((band.stop-1)*probe.dj)
+            _, fourier_factor, coi_factor, _ = wave_bases(
+                probe.mother, np.array([0., 1.]), max_scale, -1)
+            coi_overlap = math.ceil(fourier_factor*max_scale/(coi_factor*self.cadence))
+        return coi_overlap + int(time_thresh/self.cadence)
+
+    def _segments(self):
+        """
+        The (start, end, core_start, core_end) indices of every segment.
+        The cores tile the data without overlapping.
+        """
+        n = len(self.data)
+        segments = []
+        for core_start in range(0, n, self.segment_samples):
+            core_end = min(core_start + self.segment_samples, n)
+            segments.append((max(core_start - self.overlap, 0),
+                            min(core_end + self.overlap, n),
+                            core_start, core_end))
+        return segments
+
+    def _stitch(self, segments, results):
+        """
+        Combine the segment core filtered data and microburst indices.
+        """
+        self.dataFlt = np.full(len(self.data), np.nan)
+        indicies = []
+        for (start, end, core_start, core_end), (dataFlt, segment_indicies) in zip(segments, results):
+            self.dataFlt[core_start:core_end] = dataFlt[core_start-start:core_end-start]
+            segment_indicies = segment_indicies + start
+            indicies.append(segment_indicies[
+                (segment_indicies >= core_start) & (segment_indicies < core_end)
+                ])
+        self.indicies = np.concatenate(indicies)
+        return
+
+    def _find_peaks(self):
+        """
+        Find the peak of every run of consecutive microburst indices, like
+        WaveletDetector.findMicroburstPeaks.
+        """
+        runs = np.split(self.indicies, np.where(np.diff(self.indicies) != 1)[0] + 1)
+        runs = [run for run in runs if len(run) > 0]
+        self.peaks = np.array([run[np.argmax(self.data[run])] for run in runs], dtype=int)
+        self.startInd = np.array([run[0] for run in runs], dtype=int)
+        self.endInd = np.array([run[-1]+1 for run in runs], dtype=int)
+        return
+
+    def __repr__(self):
+        params = ', '.join(
+                [f'cadence={self.cadence}',
+                f'segment_s={self.segment_s}',
+                f'lower_period={self.lower_period}',
+                f'upper_period={self.upper_period}'] +
+                [f'{key}={val}' for key, val in self.detector_kwargs.items()]
+                )
+        return f'{self.__class__.__qualname__}(' + params + ')'
+
+
+def _detect_segment(data, time, cadence, lower_period, upper_period,
+                    detector_kwargs, test_kwargs):
+    """
+    Run the WaveletDetector on one segment. Returns the filtered data and
+    the (segment) indices that satisfied the microburst criteria.
+    """
+    detector = WaveletDetector(data, time, cadence, **detector_kwargs)
+    detector.filteredInvWaveletTransform(lower_period, upper_period)
+    detector.TestForMicrobursts(**test_kwargs)
+    return detector.dataFlt, detector.indicies
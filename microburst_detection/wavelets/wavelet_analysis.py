@@ -8,16 +8,25 @@ import pandas as pd
 import matplotlib.pylab as plt
 import matplotlib
 
-from .wavelet_functions import wavelet, wave_signif
+from .wavelet_functions import wavelet, wavelet_blocks, wave_signif
 
 
 class WaveletDetector():
     def __init__(self, data, time, cadence, **kwargs):
         """
-        Initialize the wavelet parameters
+        Initialize the wavelet parameters. The data is normalized by its 
+        mean and standard deviation, and the significance uses its lag-1 
+        autocorrelation, unless the mean, std, and lag1 kwargs are given, 
+        e.g. when data is one segment of a longer time series.
         """
         self.dataCopy = data
-        self.data = (data - np.mean(data)) / np.std(data, ddof=1)
+        self.dataMean = kwargs.get('mean', None)
+        if self.dataMean is None:
+            self.dataMean = np.mean(data)
+        self.dataStd = kwargs.get('std', None)
+        if self.dataStd is None:
+            self.dataStd = np.std(data, ddof=1)
+        self.data = (data - self.dataMean) / self.dataStd
         self.n = len(self.data)
         self.time = time
         self.cadence = cadence
@@ -28,22 +37,40 @@ class WaveletDetector():
         self.dj = kwargs.get('dj', 0.125)
         self.s0 = kwargs.get('s0', 2*cadence)
         self.siglvl = kwargs.get('siglvl', 0.98)
+        self.workers = kwargs.get('workers', 1) # FFT threads, -1 for all CPUs.
                
-        self.lag1 = self.lagNAutoCorr(data, 1)
+        self.lag1 = kwargs.get('lag1', None)
+        if self.lag1 is None:
+            self.lag1 = self.lagNAutoCorr(data, 1)
         
         # Run the microburst detection scipt with a wkarg keyword
         if kwargs.get('run_scipt', False):
-            self.waveletTransform() # Transform data into wavelet space.
-            self.waveletFilter(self.s0, 0.5) # Apply a high-pass and significance filter
-            self.degenerateInvWaveletTransform() # Inverse tranform the leftovers to time-count space.
+            # Transform data into wavelet space (only the filter band), apply a high-pass 
+            # and significance filter, and inverse tranform the leftovers to time-count space.
+            self.filteredInvWaveletTransform(self.s0, 0.5)
             self.TestForMicrobursts(COUNT_THRESH = 0.0) # Apply microburst test.
             print('Done detecting microbursts. Use the class indicies array.')
         return
         
-    def waveletTransform(self):
+    def waveletTransform(self, lowerPeriod=None, upperPeriod=None):
+        """
+        Wavelet transform the data. If lowerPeriod and upperPeriod are given,
+        only the scales that waveletFilter(lowerPeriod, upperPeriod) passes
+        are computed, so self.wave, self.power, self.sig95, self.period, and
+        self.scale only have the rows of those scales. The rows start at
+        scale index self.scaleOffset.
+        """
+        if (lowerPeriod is None) or (upperPeriod is None):
+            scales = slice(None)
+            self.scaleOffset = 0
+        else:
+            scales = self.scaleBand(lowerPeriod, upperPeriod)
+            self.scaleOffset = scales.start
+            
         # Wavelet transform:
         self.wave, self.period, self.scale, self.coi = \
-            wavelet(self.data, self.cadence, self.pad, self.dj, self.s0, self.j1, self.mother)
+            wavelet(self.data, self.cadence, self.pad, self.dj, self.s0, self.j1, self.mother,
+                    workers=self.workers, scales=scales)
     
         if len(self.time) != len(self.coi):
             self.coi = self.coi[1:]
@@ -51,10 +78,12 @@ class WaveletDetector():
         self.power = (np.abs(self.wave)) ** 2  # compute wavelet power spectrum
 
         # Significance levels: (variance=1 for the normalized data)
-        signif = wave_signif(([1.0]), dt=self.cadence, sigtest=0, scale=self.scale, \
-            lag1=self.lag1, mother=self.mother, siglvl = self.siglvl)
-        self.sig95 = signif[:, np.newaxis].dot(np.ones(self.n)[np.newaxis, :])  # expand signif --> (J+1)x(N) array
-        self.sig95 = self.power / self.sig95  # where ratio > 1, power is significant
+        if len(self.scale) == 0:
+            signif = np.zeros(0) # An empty band.
+        else:
+            signif = wave_signif(([1.0]), dt=self.cadence, sigtest=0, scale=self.scale, \
+                lag1=self.lag1, mother=self.mother, siglvl = self.siglvl)
+        self.sig95 = self.power / signif[:, np.newaxis]  # where ratio > 1, power is significant
         return
         
     def waveletFilter(self, lowerPeriod, upperPeriod):
@@ -68,37 +97,91 @@ class WaveletDetector():
         # jth scale indicie = ln(S/S0)/(dJ * ln(2))
         ##################################    
         """
-        lowerScale = int(np.floor(m.log(lowerPeriod/self.s0)/(self.dj*m.log(2))))
-        upperScale = int(np.floor(m.log(upperPeriod/self.s0)/(self.dj*m.log(2))))
+        band = self.scaleBand(lowerPeriod, upperPeriod)
         
         self.waveFlt = self.wave
         
         # Band pass filter
         # Zero out parts of the wavelet space that we don't want to reconstruct. 
-        self.waveFlt[upperScale:, :] = 0
-        self.waveFlt[:lowerScale, :] = 0
+        # The rows of self.wave start at scale index self.scaleOffset.
+        self.waveFlt[max(band.stop - self.scaleOffset, 0):, :] = 0
+        self.waveFlt[:max(band.start - self.scaleOffset, 0), :] = 0
     
         # Significance filter. Only pass data that has was significant above 
         # the red noise level defined in self.siglvl
-        notSigInd = np.where(self.sig95 < 1) 
-        self.waveFlt[notSigInd] = 0
+        self.waveFlt[self.sig95 < 1] = 0
         return self.waveFlt
         
+    def scaleBand(self, lowerPeriod, upperPeriod):
+        """
+        NAME:    scaleBand(lowerPeriod, upperPeriod)
+        USE:     Finds the scale indicies that are passed by the waveletFilter() 
+                 band pass filter.
+        RETURNS: A slice of the scale indicies, j = 0...j1.
+        """
+        lowerScale = int(np.floor(m.log(lowerPeriod/self.s0)/(self.dj*m.log(2))))
+        upperScale = int(np.floor(m.log(upperPeriod/self.s0)/(self.dj*m.log(2))))
+        
+        if self.j1 == -1:
+            # The default number of scales in wavelet()
+            nScales = int(np.fix((np.log(self.n*self.cadence/self.s0)/np.log(2))/self.dj)) + 1
+        else:
+            nScales = int(self.j1) + 1
+        # The filter zeroes wave[upperScale:] and wave[:lowerScale], so the 
+        # negative and out of range indicies follow the slicing rules.
+        lowerScale = slice(None, lowerScale).indices(nScales)[1]
+        upperScale = slice(upperScale, None).indices(nScales)[0]
+        return slice(lowerScale, max(lowerScale, upperScale))
+        
     def degenerateInvWaveletTransform(self, waveFlt = None, C_d = 3.541, psi0 = 0.867):
         """
         Supply own C_d and psi0 if not using a DOG m = 2 wavelet.
         """
-        if waveFlt == None:
+        if waveFlt is None:
             waveFlt = self.waveFlt
             
-        InvTranform = np.zeros(self.n)
         tansformConstant = ((self.dj*m.sqrt(self.cadence))/(C_d*psi0) ) # Reconstruction constant. 
         
         # For more information, see article: "A Practical Guide to Wavelet Analysis", C. Torrence and G. P. Compo, 1998.
-        for i in range(waveFlt.shape[0]):
-            waveFlt[i, :] /= m.sqrt(self.period[i])
-        for i in range(self.n):
-            InvTranform[i] = np.sum(np.real(waveFlt[:, i]), axis = 0)
+        waveFlt /= np.sqrt(self.period)[:, np.newaxis]
+        InvTranform = np.sum(np.real(waveFlt), axis = 0)
+        self.dataFlt = tansformConstant*InvTranform
+        return self.dataFlt
+        
+    def filteredInvWaveletTransform(self, lowerPeriod, upperPeriod, C_d = 3.541, psi0 = 0.867):
+        """
+        NAME:    filteredInvWaveletTransform(lowerPeriod, upperPeriod, C_d = 3.541, psi0 = 0.867)
+        USE:     The same as waveletTransform(lowerPeriod, upperPeriod), waveletFilter(lowerPeriod, 
+                 upperPeriod), and degenerateInvWaveletTransform(C_d, psi0), but the filtered wavelet 
+                 rows are summed a block of scales at a time. The wave, power, sig95, and waveFlt 
+                 arrays are never made, so the extra memory is O(N) and full days fit in memory.
+                 Supply own C_d and psi0 if not using a DOG m = 2 wavelet.
+        RETURNS: The filtered data, self.dataFlt.
+        """
+        scales = self.scaleBand(lowerPeriod, upperPeriod)
+        self.scaleOffset = scales.start
+        InvTranform = np.zeros(self.n)
+        tansformConstant = ((self.dj*m.sqrt(self.cadence))/(C_d*psi0) ) # Reconstruction constant. 
+        
+        for rows, waveBlock, self.period, self.scale, self.coi in wavelet_blocks(
+                self.data, self.cadence, self.pad, self.dj, self.s0, self.j1, self.mother,
+                workers=self.workers, scales=scales):
+            if waveBlock.shape[0] == 0:
+                continue # An empty band.
+            # Significance levels: (variance=1 for the normalized data)
+            signif = wave_signif(([1.0]), dt=self.cadence, sigtest=0, scale=self.scale[rows], \
+                lag1=self.lag1, mother=self.mother, siglvl = self.siglvl)
+            # Significance filter, then the 1/sqrt(period) weights of the inverse transform.
+            notSig = (np.abs(waveBlock) ** 2) / signif[:, np.newaxis] < 1
+            waveReal = np.where(notSig, 0, np.real(waveBlock))
+            # (multiplied by the reciprocal like the complex division in degenerateInvWaveletTransform)
+            waveReal *= (1/np.sqrt(self.period[rows]))[:, np.newaxis]
+            # Sum the rows in order, like the np.sum() in degenerateInvWaveletTransform.
+            for row in waveReal:
+                InvTranform += row
+            
+        if len(self.time) != len(self.coi):
+            self.coi = self.coi[1:]
         self.dataFlt = tansformConstant*InvTranform
         return self.dataFlt
         
@@ -109,36 +192,49 @@ class WaveletDetector():
         CONCAVITY_THRESH = 0.3 # Max allowable fractional difference to be classified as a microburst. 
         TIME_THRESH = 1 # In seconds.
         """
-        if dataFlt == None:
+        if dataFlt is None:
             dataFlt = self.dataFlt
             
-        self.indicies = np. array([], dtype = int)
-        tDiff = np.zeros(len(self.time)-1)
-        
         COUNT_THRESH = kwargs.get('COUNT_THRESH', 0.05)
         TIME_THRESH = kwargs.get('TIME_THRESH', 1.00)
         
         DATA_GAP_THRESH = int(TIME_THRESH/self.cadence)
         
         if (isinstance(self.time[0], datetime.datetime) or isinstance(self.time[0], pd.DatetimeIndex)):
-            for i in range(len(self.time)-1):
-                tDiff[i] = (self.time[i+1] - self.time[i]).total_seconds()
+            tDiff = np.diff(np.asarray(self.time, dtype='datetime64[ns]'))/np.timedelta64(1, 's')
         else:
             tDiff = np.abs(np.convolve([-1, 1], self.time, mode = 'same'))
     
         # Now determine which events are microbursts and which ones are false positives.
         #dropoutFlag = flag_dropouts.dropOutFlag(self.dataCopy)
-        for i in range(DATA_GAP_THRESH, int(len(self.dataCopy) - DATA_GAP_THRESH)):
-                # Apply the microburst filters. 
-                # The 2*cadence is there since the change in data time stamps may
-                # normally be around 30 ms for 18.75 ms cadence.
-                if (
-                    dataFlt[i] > COUNT_THRESH \
-                    and np.abs(max(tDiff[(i - DATA_GAP_THRESH):(i + DATA_GAP_THRESH)])) < 2*self.cadence \
-                    and self.dataCopy[i] > 100
-                    ):
-                    # these are the good detections. 
-                    self.indicies = np.append(self.indicies, i)
+        indicies = np.arange(DATA_GAP_THRESH, int(len(self.dataCopy) - DATA_GAP_THRESH))
+        if len(indicies) == 0:
+            self.indicies = indicies
+            return self.indicies
+        # The abs(max(tDiff[(i - DATA_GAP_THRESH):(i + DATA_GAP_THRESH)])) < 2*cadence
+        # test for every index i, from cumulative counts of the time steps that 
+        # are too long, and the time steps that are not too negative.
+        # The number of steps in the window is nLong[i + DATA_GAP_THRESH] - nLong[i - DATA_GAP_THRESH].
+        # Like the builtin max(), a NaN time step only fails the window that it starts.
+        nLong = np.concatenate(([0], np.cumsum(tDiff >= 2*self.cadence)))
+        nShort = np.concatenate(([0], np.cumsum(tDiff > -2*self.cadence)))
+        windowEnd = indicies + DATA_GAP_THRESH
+        windowStart = indicies - DATA_GAP_THRESH
+        noGaps = (
+            (nLong[windowEnd] - nLong[windowStart] == 0) 
+            & (nShort[windowEnd] - nShort[windowStart] > 0)
+            & ~np.isnan(tDiff[windowStart])
+            )
+        # Apply the microburst filters. 
+        # The 2*cadence is there since the change in data time stamps may
+        # normally be around 30 ms for 18.75 ms cadence.
+        good = (
+            (np.asarray(dataFlt)[indicies] > COUNT_THRESH) 
+            & noGaps 
+            & (np.asarray(self.dataCopy)[indicies] > 100)
+            )
+        # these are the good detections. 
+        self.indicies = indicies[good]
         return self.indicies
         
         
@@ -179,7 +275,7 @@ class WaveletDetector():
         """
         self.levels = [0.0625, 0.125, 0.25, 0.5, 1, 2, 4, 8, 16]
         
-        if ax == None:
+        if ax is None:
             f = plt.figure()    
             f, ax = plt.subplots(1)
         else:
@@ -209,7 +305,8 @@ class WaveletDetector():
         # plt.colorbar(im, cax=cax, orientation='horizontal')
         #######################################
 
-    def lagNAutoCorr(self, x, n):
+    @staticmethod
+    def lagNAutoCorr(x, n):
         """
         NAME:    lagNAutoCorr(x, n)
         USE:     Call it with an integer n, to get a lag-n autocorrelation 
@@ -1,9 +1,20 @@
+import collections
+import functools
+
 from scipy.special._ufuncs import gammainc, gamma
 import numpy as np
+import scipy.fft
 from scipy.optimize import fminbound
 
 __author__ = 'Evgeniya Predybaylo'
 
+# The maximum number of (complex) daughter wavelet values that wavelet()
+# computes at once.
+WAVE_BLOCK_SIZE = 2 ** 23
+# The maximum total size (in bytes) of the daughter wavelets cached by
+# daughter_wavelets().
+DAUGHTER_CACHE_BYTES = 2 ** 28
+
 
 # Copyright (C) 1995-2004, Christopher Torrence and Gilbert P.Compo
 # Python version of the code is written by Evgeniya Predybaylo in 2014
@@ -31,7 +42,7 @@ __author__ = 'Evgeniya Predybaylo'
 
 
 # # WAVELET  1D Wavelet transform with optional significance testing
-#   wave, period, scale, coi = wavelet(Y, dt, pad, dj, s0, J1, mother, param)
+#   wave, period, scale, coi = wavelet(Y, dt, pad, dj, s0, J1, mother, param, workers, scales)
 #
 #   Computes the wavelet transform of the vector Y (length N),
 #   with sampling rate DT.
@@ -79,6 +90,14 @@ __author__ = 'Evgeniya Predybaylo'
 #            For 'PAUL' this is m (order), default is 4.
 #            For 'DOG' this is m (m-th derivative), default is 2.
 #
+#    WORKERS = the number of threads for the inverse FFTs (see scipy.fft).
+#            Default is 1. If -1, all of the CPUs are used.
+#
+#    SCALES = a slice of the scale indices j=0...J1 to compute, e.g.
+#            slice(0, 10) for the 10 smallest scales. Default is all of the
+#            scales. WAVE, PERIOD, and SCALE only contain the rows of these
+#            scales, and the rows are identical to the full transform's.
+#
 #
 # OPTIONAL OUTPUTS:
 #
@@ -93,8 +112,39 @@ __author__ = 'Evgeniya Predybaylo'
 #        at that particular time.
 #        Periods greater than this are subject to edge effects.
 
-# def wavelet(Y, dt, pad=0, dj=-1, s0=-1, J1=-1, mother=-1, param=-1):
-def wavelet(Y, dt, pad=0, dj=-1, s0=-1, J1=-1, mother=-1, param=-1):
+# def wavelet(Y, dt, pad=0, dj=-1, s0=-1, J1=-1, mother=-1, param=-1, workers=1, scales=None):
+def wavelet(Y, dt, pad=0, dj=-1, s0=-1, J1=-1, mother=-1, param=-1, workers=1, scales=None):
+	for rows, wave_block, period, scale, coi in wavelet_blocks(
+			Y, dt, pad, dj, s0, J1, mother, param, workers, scales):
+		if rows.start == 0:
+			wave = np.zeros(shape=(len(scale), len(Y)), dtype=complex)  # define the wavelet array
+		wave[rows, :] = wave_block
+
+	return wave, period, scale, coi
+
+#-------------------------------------------------------------------------------------------------------------------
+# WAVELET_BLOCKS  1D Wavelet transform, one block of scales at a time
+#
+#   for rows, wave_block, period, scale, coi in wavelet_blocks(Y, dt, pad, dj, s0, J1, mother, param, workers, scales):
+#
+#   The same as WAVELET, but the WAVE rows are generated in blocks of about
+#   WAVE_BLOCK_SIZE complex numbers instead of returned as one array, so
+#   the memory does not grow with the number of scales.
+#   (This program is called automatically by WAVELET)
+#
+# INPUTS:
+#
+#    The same as WAVELET.
+#
+# OUTPUTS (for every block):
+#
+#    ROWS = the slice of the WAVE rows (and SCALE indices) in this block.
+#    WAVE_BLOCK = the WAVE[ROWS, :] rows of the WAVELET transform.
+#    PERIOD, SCALE, COI = the same as WAVELET, for all of the scales.
+#
+#   If there are no scales, one empty block is generated.
+
+def wavelet_blocks(Y, dt, pad=0, dj=-1, s0=-1, J1=-1, mother=-1, param=-1, workers=1, scales=None):
 	n1 = len(Y)
 
 	if s0 == -1:
@@ -121,24 +171,29 @@ def wavelet(Y, dt, pad=0, dj=-1, s0=-1, J1=-1, mother=-1, param=-1):
 	k = np.concatenate(([0.], kplus, kminus))
 
 	#....compute FFT of the (padded) time series
-	f = np.fft.fft(x)  # [Eqn(3)]
+	f = scipy.fft.fft(x)  # [Eqn(3)]
 
 	#....construct SCALE array & empty PERIOD & WAVE arrays
 	j = np.arange(0,J1+1)
+	if scales is not None:
+		j = j[scales]
 	scale = s0 * 2. ** (j * dj)
-	wave = np.zeros(shape=(J1 + 1, n), dtype=complex)  # define the wavelet array
-
-	# loop through all scales and compute transform
-	for a1 in range(0, int(J1+1)):
-		daughter, fourier_factor, coi, dofmin = wave_bases(mother, k, scale[a1], param)
-		wave[a1, :] = np.fft.ifft(f * daughter)  # wavelet transform[Eqn(4)]
-
-	period = fourier_factor * scale  #[Table(1)]
-	coi = coi * dt * np.concatenate((np.insert(np.arange((n1 + 1) / 2 - 1), [0], [1E-5]),
-									 np.insert(np.flipud(np.arange(0, n1 / 2 - 1)), [-1], [1E-5])))  # COI [Sec.3g]
-	wave = wave[:, :n1]  # get rid of padding before returning
 
-	return wave, period, scale, coi
+	# compute the transform for a block of scales at a time: the daughter
+	# wavelets of a block are one (scales x n) array, and the inverse FFTs
+	# of all of its rows are one call. The blocks limit the memory to
+	# about WAVE_BLOCK_SIZE complex numbers.
+	block_scales = max(1, WAVE_BLOCK_SIZE // n)
+	# (one empty block if there are no scales, for FOURIER_FACTOR and COI)
+	for a1 in range(0, max(len(scale), 1), block_scales):
+		daughter, fourier_factor, coi_factor, dofmin = daughter_wavelets(
+			mother, k, scale[a1:a1 + block_scales, np.newaxis], param, dt)
+		if a1 == 0:
+			period = fourier_factor * scale  #[Table(1)]
+			coi = coi_factor * dt * np.concatenate((np.insert(np.arange((n1 + 1) / 2 - 1), [0], [1E-5]),
+										 np.insert(np.flipud(np.arange(0, n1 / 2 - 1)), [-1], [1E-5])))  # COI [Sec.3g]
+		wave_block = scipy.fft.ifft(f * daughter, axis=1, overwrite_x=True, workers=workers)  # wavelet transform[Eqn(4)]
+		yield slice(a1, a1 + len(daughter)), wave_block[:, :n1], period, scale, coi  # get rid of padding
 
 #-------------------------------------------------------------------------------------------------------------------
 # WAVE_BASES  1D Wavelet functions Morlet, Paul, or DOG
@@ -153,7 +208,8 @@ def wavelet(Y, dt, pad=0, dj=-1, s0=-1, J1=-1, mother=-1, param=-1):
 #
 #    MOTHER = a string, equal to 'MORLET' or 'PAUL' or 'DOG'
 #    K = a vector, the Fourier frequencies at which to calculate the wavelet
-#    SCALE = a number, the wavelet scale
+#    SCALE = a number, the wavelet scale, or a column vector (shape (J, 1))
+#            of scales, then DAUGHTER is a (J, len(K)) array
 #    PARAM = the nondimensional parameter for the wavelet function
 #
 # OUTPUTS:
@@ -207,6 +263,37 @@ def wave_bases(mother, k, scale, param):
 
 	return daughter, fourier_factor, coi, dofmin
 
+#-------------------------------------------------------------------------------------------------------------------
+# DAUGHTER_WAVELETS  Cached WAVE_BASES
+#
+#  DAUGHTER,FOURIER_FACTOR,COI,DOFMIN = daughter_wavelets(MOTHER,K,SCALE,PARAM,DT)
+#
+#   The same as WAVE_BASES, but the outputs are cached since they are the
+#   same for every time series with the same length, DT, and wavelet
+#   parameters. The least recently used outputs are evicted when the
+#   daughter wavelets in the cache are larger than DAUGHTER_CACHE_BYTES.
+#   (This program is called automatically by WAVELET)
+#
+#   K is determined by its length and DT (see WAVELET), so it is not part
+#   of the cache key. The returned DAUGHTER is read-only.
+
+_daughter_cache = collections.OrderedDict()
+
+def daughter_wavelets(mother, k, scale, param, dt):
+	key = (mother, param, len(k), dt, np.asarray(scale).tobytes())
+	if key in _daughter_cache:
+		_daughter_cache.move_to_end(key)
+		return _daughter_cache[key]
+
+	bases = wave_bases(mother, k, scale, param)
+	bases[0].flags.writeable = False
+	_daughter_cache[key] = bases
+	cache_bytes = sum(cached[0].nbytes for cached in _daughter_cache.values())
+	while cache_bytes > DAUGHTER_CACHE_BYTES:
+		_, evicted = _daughter_cache.popitem(last=False)
+		cache_bytes -= evicted[0].nbytes
+	return bases
+
 #-------------------------------------------------------------------------------------------------------------------
 # WAVE_SIGNIF  Significance testing for the 1D Wavelet transform WAVELET
 #
@@ -267,7 +354,7 @@ def wave_signif(Y, dt, scale, sigtest=-1, lag1=-1, siglvl=-1, dof=-1, mother=-1,
 	n1 = len(np.atleast_1d(Y))
 	J1 = len(scale) - 1
 	s0 = np.min(scale)
-	dj = np.log2(scale[1] / scale[0])
+	dj = np.log2(scale[1] / scale[0]) if J1 > 0 else -1  # only used by SIGTEST=2
 
 	if n1 == 1:
 		variance = Y
@@ -369,10 +456,14 @@ def wave_signif(Y, dt, scale, sigtest=-1, lag1=-1, siglvl=-1, dof=-1, mother=-1,
 #   This means that P*100 percent of the distribution lies between 0 and X.
 #
 #   To check, the answer should satisfy:   P==gammainc(X/2,V/2)
+#
+#   The results are cached since the same (P, V) are used for every
+#   time series.
 
 # Uses FMIN and CHISQUARE_SOLVE
 
 
+@functools.lru_cache(maxsize=1024)
 def chisquare_inv(P, V):
 
 	if (1 - P) < 1E-4:
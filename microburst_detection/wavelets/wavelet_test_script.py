@@ -5,28 +5,25 @@ import pathlib
 import string
 from datetime import datetime
 
-import pandas as pd
 import numpy as np
 import matplotlib.pylab as plt
 
 from microburst_detection.wavelets import wavelet_analysis
 from microburst_detection import config
 from microburst_detection.misc.load_firebird import readJSONheadedASCII
+from microburst_detection.misc.hires_manifest import HiResManifest
 
 plt.rcParams.update({'font.size': 13})
 
 # Load example HiRes data
 sc_id = 4
 hr_date = datetime(2019, 9, 27) 
-search_str = f'FU{sc_id}*Hires*{hr_date.year}*{hr_date.month}*{hr_date.day}*L2*'
-hr_paths = list(pathlib.Path(config.FB_DIR, ).rglob(search_str))
-assert len(hr_paths) == 1, (f'A unique HiRes path not found.\n'
-                            f'hr_paths={hr_paths} search_str={search_str}')
-hr_path = str(hr_paths[0])
-hr = readJSONheadedASCII(hr_path)
-
-# Convert time array
-hr['Time'] = pd.to_datetime(hr['Time'])
+manifest = HiResManifest(
+    config.FB_DIR, pathlib.Path(config.PROJECT_DIR, 'data', 'hires_manifest.json')
+    )
+hr_path = manifest.path(sc_id, hr_date)
+hr = readJSONheadedASCII(hr_path, columns=['Col_counts'])
+
 cadence = float(hr.attrs['CADENCE'])
 cadence_int = int(cadence*1000)
 